@@ -240,6 +240,96 @@ NEWSLETTER_EMAIL_CONFIRMATION_EXPIRE_DAYS = 3
 NEWSLETTER_SEND_VERIFICATION = True
 
 
+# ARXIV INGEST CONFIGURATION
+ARXIV_BASE_URL = env("ARXIV_BASE_URL", default="https://arxiv.org")
+# Maximum concurrent requests per host
+ARXIV_FETCH_CONCURRENCY = 4
+ARXIV_FETCH_RETRIES = 3
+# Base delay (in seconds) of the exponential retry backoff
+ARXIV_FETCH_BACKOFF = 1.0
+ARXIV_FETCH_TIMEOUT = 30
+# Requests per second allowed to arxiv.org across all workers, and burst size
+ARXIV_RATE_LIMIT = 4
+ARXIV_RATE_BURST = 4
+# Cache alias shared by all workers that holds the rate limiter state
+ARXIV_RATE_LIMIT_CACHE = "default"
+# Cache alias holding listing/archive pages for conditional GETs
+ARXIV_HTTP_CACHE = "default"
+ARXIV_HTTP_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# Listing page parser backend: "lxml" (streaming) or "soup"
+ARXIV_LISTING_PARSER = "lxml"
+# Worker threads per ingest pipeline stage and the size of the queues between them
+ARXIV_PIPELINE_WORKERS = {
+    "fetch": ARXIV_FETCH_CONCURRENCY,
+    "parse": 2,
+    "normalize": 1,
+    # Keep a single writer on SQLite, which locks the whole database
+    "persist": 1,
+}
+ARXIV_PIPELINE_QUEUE_SIZE = 8
+# OAI-PMH endpoint and checkpoint file used by `load_papers --backfill`
+ARXIV_OAI_URL = env("ARXIV_OAI_URL", default="https://export.arxiv.org/oai2")
+ARXIV_OAI_CHECKPOINT = "newsletter/utils/data/oai_checkpoint.json"
+# Directory fetched pages are recorded to as fixtures, recording is off if unset
+ARXIV_RECORD_DIR = env("ARXIV_RECORD_DIR", default=None)
+ARXIV_RECORDINGS = "newsletter/utils/data/recordings"
+
+
+# EMBEDDING CONFIGURATION
+# Embeddings of the PGVector collections: "local" (EMBEDDING_MODEL run in
+# process), "openai" or "fake" (deterministic, for tests)
+EMBEDDING_BACKEND = env("EMBEDDING_BACKEND", default="local")
+# sentence-transformers model used for paper chunks and search queries
+EMBEDDING_MODEL = env("EMBEDDING_MODEL", default="sentence-transformers/all-MiniLM-L6-v2")
+# Device the models run on, e.g. "cpu" or "cuda", picked automatically if unset
+EMBEDDING_DEVICE = env("EMBEDDING_DEVICE", default=None)
+# Stamped on every chunk, change it to have `embed_papers` embed all papers again
+EMBEDDING_MODEL_VERSION = env("EMBEDDING_MODEL_VERSION", default=EMBEDDING_MODEL)
+# Progress file of the `embed_papers` backfill command
+EMBEDDING_BACKFILL_CHECKPOINT = "newsletter/utils/data/embed_checkpoint.json"
+# Chunks encoded per forward pass when embedding papers in bulk
+EMBEDDING_BATCH_SIZE = 64
+# Tokens repeated between consecutive chunks of a paper
+EMBEDDING_CHUNK_OVERLAP = 0
+# Threads used by torch for inference, torch's default (physical cores) if unset
+EMBEDDING_THREADS = env.int("EMBEDDING_THREADS", default=None)
+# Reuse the embeddings of texts already embedded by the same model
+EMBEDDING_CACHE = True
+# Also store chunk embeddings as float16 halfvecs and search those first
+EMBEDDING_HALF_PRECISION = True
+# Candidates fetched from the halfvecs per result, then re-ranked exactly
+EMBEDDING_RERANK_FACTOR = 10
+# Minimum candidate list size of HNSW index scans (pgvector's hnsw.ef_search),
+# raised to the number of rows a search fetches, up to 1000
+EMBEDDING_HNSW_EF_SEARCH = 100
+# Inference runtime: "torch" (sentence-transformers) or "onnx" (onnxruntime,
+# run `manage.py export_onnx` first)
+EMBEDDING_RUNTIME = env("EMBEDDING_RUNTIME", default="torch")
+EMBEDDING_ONNX_DIR = "newsletter/utils/data/onnx"
+# Use the int8-quantized export when there is one
+EMBEDDING_ONNX_QUANTIZED = True
+# Models loaded when a Celery worker process starts
+EMBEDDING_WARM_UP_MODELS = [EMBEDDING_MODEL]
+
+
+# SEARCH CONFIGURATION
+# Nearest chunks a semantic search groups into papers
+SEARCH_CANDIDATES = 100
+SEARCH_PAGE_SIZE = 10
+# Rank offset of the reciprocal rank fusion of full-text and semantic results,
+# larger values flatten the advantage of the top ranks
+SEARCH_RRF_K = 60
+# Chunk embeddings searched by "pgvector" (Postgres) or "numpy" (memory-mapped
+# files, for SQLite), picked from the database engine if unset. Run
+# `manage.py vector_index --rebuild` to fill the NumPy index.
+SEARCH_VECTOR_INDEX = env("SEARCH_VECTOR_INDEX", default=None)
+SEARCH_NUMPY_INDEX_DIR = "newsletter/utils/data/vector_index"
+# Papers stored as the similar papers of each paper by `compute_similar_papers`
+SIMILAR_PAPERS_K = 5
+# Nearest chunks those are picked from
+SIMILAR_PAPERS_CANDIDATES = 50
+
+
 # STRIPE CONFIGURATION
 STRIPE_PUBLIC_KEY = env("STRIPE_PUBLIC_KEY")
 STRIPE_SECRET_KEY = env("STRIPE_SECRET_KEY")
@@ -0,0 +1,66 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from newsletter.models import Paper
+from newsletter.utils.embeddings import EmbeddingEngine, get_chunks
+from newsletter.utils.model_registry import registry
+from newsletter.utils.parsers import get_listing_parser
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures chunks embedded per second with the former one chunk at a time "
+        "path and with the batched EmbeddingEngine, on the recorded listings"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--fixtures",
+            default=f"{settings.ARXIV_RECORDINGS}/list",
+            help="Directory searched recursively for recorded listing pages (*.html)",
+        )
+        parser.add_argument("--papers", type=int, help="Number of papers embedded")
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument("--model", help="Model name, EMBEDDING_MODEL by default")
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        parser = get_listing_parser()
+        papers = [
+            Paper(title=paper["title"], abstract=paper["abstract"])
+            for path in sorted(Path(options["fixtures"]).rglob("*.html"))
+            for paper in parser.parse(path.read_text(encoding="utf-8"))
+        ][: options["papers"]]
+        if not papers:
+            raise CommandError(f"No recorded papers found in {options['fixtures']}")
+
+        name = options["model"] or settings.EMBEDDING_MODEL
+        # Cached chunks would skip the model, and the run would fill the cache table
+        engine = EmbeddingEngine(name, options["batch_size"], cache=False)
+        # Keep the model load out of the timings
+        registry.warm_up([name])
+
+        start = time.perf_counter()
+        chunks = 0
+        for paper in papers:
+            for chunk in get_chunks(paper.title + "\n" + paper.abstract):
+                registry.tokenize(chunk, name)
+                registry.encode(chunk, name)
+                chunks += 1
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched_chunks = len(engine.embed(papers))
+        batched = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{len(papers)} papers, batch size {engine.batch_size}\n"
+            f"  one chunk at a time: {chunks / single:,.1f} chunks/sec "
+            f"({chunks} chunks of 750 characters, {single:.2f}s)\n"
+            f"  batched:             {batched_chunks / batched:,.1f} chunks/sec "
+            f"({batched_chunks} chunks of up to {engine.chunker.max_tokens} tokens, "
+            f"{batched:.2f}s)"
+        )
@@ -0,0 +1,119 @@
+import time
+import resource
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from newsletter.models import Paper
+from newsletter.tasks import embed_papers
+from newsletter.utils.arxiv import get_papers, load_categories
+from newsletter.utils.recordings import ReplayServer
+
+
+class QueryCounter:
+    """Counts the queries run on every connection it is installed on."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the daily arXiv ingest end to end against recorded pages served "
+        "locally, in a throwaway test database, and reports its throughput"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--fixtures",
+            default=settings.ARXIV_RECORDINGS,
+            help="Recordings directory, with listings under list/<category>/new.html",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0,
+            help="Simulated network latency per request, in seconds",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            help="Apply this request rate limit, unthrottled by default",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        listings = sorted(Path(options["fixtures"]).glob("list/*/new.html"))
+        if not listings:
+            raise CommandError(f"No recorded listings found in {options['fixtures']}")
+        abbrvs = [listing.parent.name for listing in listings]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            if connection.vendor == "sqlite":
+                # Worker threads can't share an in-memory SQLite database
+                connection.settings_dict["TEST"]["NAME"] = f"{tmp}/benchmark.sqlite3"
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                self.benchmark(abbrvs, tmp, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def benchmark(self, abbrvs, tmp, options):
+        load_categories([{"name": abbrv, "abbrv": abbrv} for abbrv in abbrvs])
+
+        counter = QueryCounter()
+        counter.install(connection=connection)
+        connection_created.connect(counter.install)
+
+        rate = options["rate"] or 1_000_000
+        try:
+            with ReplayServer(options["fixtures"], options["latency"]) as server:
+                # Embedding runs on the Celery workers, outside the ingest
+                with override_settings(
+                    ARXIV_BASE_URL=server.url,
+                    ARXIV_RATE_LIMIT=rate,
+                    ARXIV_RATE_BURST=max(1, int(rate)),
+                    ARXIV_RECORD_DIR=None,
+                ), mock.patch.object(embed_papers, "delay"):
+                    start = time.perf_counter()
+                    stats = get_papers(path=f"{tmp}/papers", abbrvs=abbrvs)
+                    elapsed = time.perf_counter() - start
+        finally:
+            connection_created.disconnect(counter.install)
+            connection.execute_wrappers.remove(counter)
+
+        for stage in stats:
+            self.stdout.write(str(stage))
+            for item, error in stage.errors:
+                self.stderr.write(f"  {item}: {error}")
+
+        pages = server.requests
+        papers = Paper.objects.count()
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(
+            f"{len(abbrvs)} listings, {pages} pages, {papers} papers in {elapsed:.2f}s\n"
+            f"  {pages / elapsed:,.1f} pages/sec\n"
+            f"  {papers / elapsed:,.1f} papers/sec\n"
+            f"  {counter.count / max(papers, 1):.2f} queries/paper "
+            f"({counter.count} queries)\n"
+            f"  {peak_rss:,.1f} MiB peak RSS"
+        )
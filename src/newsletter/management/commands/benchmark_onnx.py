@@ -0,0 +1,97 @@
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from newsletter.utils.onnx_encoder import (
+    MODEL_FILE,
+    QUANTIZED_MODEL_FILE,
+    OnnxEncoder,
+    onnx_model_dir,
+)
+from newsletter.utils.parsers import get_listing_parser
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks that the ONNX exports of the embedding model match the torch "
+        "model on cosine similarity and compares their throughput"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--fixtures",
+            default=f"{settings.ARXIV_RECORDINGS}/list",
+            help="Directory searched recursively for recorded listing pages (*.html)",
+        )
+        parser.add_argument("--model", help="Model name, EMBEDDING_MODEL by default")
+        parser.add_argument("--onnx-dir", help="Export directory of the model")
+        parser.add_argument("--batch-size", type=int, default=32)
+        parser.add_argument(
+            "--min-cosine",
+            type=float,
+            default=0.99,
+            help="Fail when any text's ONNX embedding is less similar than this",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        from sentence_transformers import SentenceTransformer
+
+        parser = get_listing_parser()
+        texts = [
+            paper["title"] + "\n" + paper["abstract"]
+            for path in sorted(Path(options["fixtures"]).rglob("*.html"))
+            for paper in parser.parse(path.read_text(encoding="utf-8"))
+        ]
+        if not texts:
+            raise CommandError(f"No recorded papers found in {options['fixtures']}")
+
+        name = options["model"] or settings.EMBEDDING_MODEL
+        directory = options["onnx_dir"] or onnx_model_dir(name)
+        batch_size = options["batch_size"]
+
+        models = {"torch": SentenceTransformer(name, device="cpu")}
+        for label, file, quantized in (
+            ("onnx", MODEL_FILE, False),
+            ("onnx int8", QUANTIZED_MODEL_FILE, True),
+        ):
+            if os.path.exists(os.path.join(directory, file)):
+                models[label] = OnnxEncoder(directory, quantized=quantized)
+        if len(models) == 1:
+            raise CommandError(f"No ONNX export in {directory}, run export_onnx")
+
+        reference, failed = None, []
+        for label, model in models.items():
+            # Warm up outside the timing
+            model.encode(texts[:batch_size], batch_size=batch_size)
+            start = time.perf_counter()
+            embeddings = model.encode(texts, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+
+            line = f"{label:>9}: {len(texts) / elapsed:,.1f} texts/sec"
+            if reference is None:
+                reference = embeddings
+            else:
+                cosine = np.sum(reference * embeddings, axis=1) / (
+                    np.linalg.norm(reference, axis=1)
+                    * np.linalg.norm(embeddings, axis=1)
+                )
+                line += f", cosine to torch min {cosine.min():.4f} mean {cosine.mean():.4f}"
+                if cosine.min() < options["min_cosine"]:
+                    failed.append(label)
+            self.stdout.write(line)
+
+        for file in (MODEL_FILE, QUANTIZED_MODEL_FILE):
+            path = os.path.join(directory, file)
+            if os.path.exists(path):
+                self.stdout.write(f"{file}: {os.path.getsize(path) / 2**20:,.1f} MiB")
+
+        if failed:
+            raise CommandError(
+                f"{', '.join(failed)} below {options['min_cosine']} cosine similarity"
+            )
+        self.stdout.write(self.style.SUCCESS("ONNX embeddings match torch"))
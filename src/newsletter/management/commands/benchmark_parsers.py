@@ -0,0 +1,56 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from newsletter.utils.parsers import PARSERS, get_listing_parser
+
+
+class Command(BaseCommand):
+    help = "Measures papers parsed per second by each listing parser on recorded pages"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--fixtures",
+            default="newsletter/utils/data/recordings/list",
+            help="Directory searched recursively for recorded listing pages (*.html)",
+        )
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument(
+            "--parsers", nargs="+", default=list(PARSERS), choices=list(PARSERS)
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        paths = sorted(Path(options["fixtures"]).rglob("*.html"))
+        if not paths:
+            raise CommandError(f"No recorded pages found in {options['fixtures']}")
+        pages = [path.read_text(encoding="utf-8") for path in paths]
+
+        results = {}
+        for name in options["parsers"]:
+            parser = get_listing_parser(name)
+            if parser.name != name:
+                self.stderr.write(f"Parser '{name}' is unavailable, skipping")
+                continue
+
+            parsed = [parser.parse(page) for page in pages]
+            papers = sum(len(papers) for papers in parsed)
+
+            start = time.perf_counter()
+            for _ in range(options["repeat"]):
+                for page in pages:
+                    parser.parse(page)
+            elapsed = time.perf_counter() - start
+
+            results[name] = parsed
+            self.stdout.write(
+                f"{name:>6}: {papers * options['repeat'] / elapsed:,.0f} papers/sec "
+                f"({len(pages)} pages, {papers} papers, {options['repeat']} rounds)"
+            )
+
+        # Every backend must return exactly the same paper dicts
+        outputs = list(results.values())
+        if any(output != outputs[0] for output in outputs[1:]):
+            raise CommandError("Parsers returned different papers")
+        self.stdout.write(self.style.SUCCESS("Parser outputs match"))
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import connections
+
+from newsletter.models import Paper, PaperChunks
+from newsletter.utils.embeddings import embed_rows, init_worker
+from newsletter.utils.vector_index import get_vector_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Embeds the papers that have no chunks yet or chunks of another "
+        "EMBEDDING_MODEL_VERSION, spread over a pool of processes"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--batch-size", type=int, default=256)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Embedding processes, one per core by default",
+        )
+        parser.add_argument("--limit", type=int, help="Stop after this many papers")
+        parser.add_argument(
+            "--checkpoint", default=settings.EMBEDDING_BACKFILL_CHECKPOINT
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint left by an interrupted run",
+        )
+        return super().add_arguments(parser)
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint, "r") as file:
+            checkpoint = json.load(file)
+        # A checkpoint of another model version is ignored
+        if checkpoint["model_version"] != self.model_version:
+            return 0
+        return checkpoint["last_id"]
+
+    def save_checkpoint(self, last_id):
+        directory = os.path.dirname(self.checkpoint)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(f"{self.checkpoint}.tmp", "w") as file:
+            json.dump({"model_version": self.model_version, "last_id": last_id}, file)
+        os.replace(f"{self.checkpoint}.tmp", self.checkpoint)
+
+    def clear_checkpoint(self):
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def batches(self, papers, last_id, batch_size, limit):
+        # Keyset pagination: every page is an index range scan from last_id
+        sent = 0
+        while limit is None or sent < limit:
+            size = batch_size if limit is None else min(batch_size, limit - sent)
+            rows = list(
+                papers.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "title", "abstract")[:size]
+            )
+            if not rows:
+                return
+            yield rows
+            sent += len(rows)
+            last_id = rows[-1][0]
+
+    def write(self, rows, future):
+        """Store the chunks of a finished batch and checkpoint past it."""
+        paper_chunks = future.result()
+        paper_ids = [row[0] for row in rows]
+        PaperChunks.objects.replace(paper_ids, paper_chunks)
+        get_vector_index().replace(paper_ids, paper_chunks)
+        # Batches are written in order, so every paper up to here is done
+        self.save_checkpoint(rows[-1][0])
+        return len(rows), len(paper_chunks)
+
+    def handle(self, *args, **options):
+        self.model_version = settings.EMBEDDING_MODEL_VERSION
+        self.checkpoint = options["checkpoint"]
+        last_id = 0 if options["restart"] else self.load_checkpoint()
+        if last_id:
+            self.stdout.write(f"Resuming after paper {last_id}")
+        papers = Paper.objects.needing_embeddings(self.model_version)
+
+        workers = max(1, options["workers"])
+        # Split the cores between the workers instead of oversubscribing them
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # Forked workers must not inherit the parent's database connections
+        connections.close_all()
+
+        embedded, chunks, start = 0, 0, time.perf_counter()
+        pending = deque()
+        with ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=init_worker,
+            initargs=(threads,),
+        ) as pool:
+            # Fork every worker now, while the parent holds no connection
+            pool.submit(int).result()
+            for rows in self.batches(
+                papers, last_id, options["batch_size"], options["limit"]
+            ):
+                pending.append((rows, pool.submit(embed_rows, rows)))
+                # Keep every worker busy with one batch queued behind it, and
+                # write the oldest batch meanwhile
+                while len(pending) >= 2 * workers or (
+                    pending and pending[0][1].done()
+                ):
+                    papers_written, chunks_written = self.write(*pending.popleft())
+                    embedded += papers_written
+                    chunks += chunks_written
+            while pending:
+                papers_written, chunks_written = self.write(*pending.popleft())
+                embedded += papers_written
+                chunks += chunks_written
+
+        # Only an interrupted run, or one cut short by --limit, resumes: the
+        # next full run starts over to pick up papers that lost their chunks
+        if options["limit"] is None or embedded < options["limit"]:
+            self.clear_checkpoint()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Embedded {embedded} papers into {chunks} chunks in {elapsed:.1f}s "
+                f"({embedded / max(elapsed, 1e-9):,.1f} papers/sec)"
+            )
+        )
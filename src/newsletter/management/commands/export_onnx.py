@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from newsletter.utils.onnx_encoder import export_onnx, onnx_model_dir
+
+
+class Command(BaseCommand):
+    help = "Exports an embedding model to ONNX for EMBEDDING_RUNTIME = 'onnx'"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--model", help="Model name, EMBEDDING_MODEL by default")
+        parser.add_argument(
+            "--output", help="Export directory, under EMBEDDING_ONNX_DIR by default"
+        )
+        parser.add_argument(
+            "--no-quantize",
+            action="store_true",
+            help="Skip writing the int8-quantized copy",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        from sentence_transformers import SentenceTransformer
+
+        name = options["model"] or settings.EMBEDDING_MODEL
+        directory = options["output"] or onnx_model_dir(name)
+        export_onnx(
+            SentenceTransformer(name, device="cpu"),
+            directory,
+            quantize=not options["no_quantize"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Exported {name} to {directory}"))
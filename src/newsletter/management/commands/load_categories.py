@@ -0,0 +1,29 @@
+import json
+
+from newsletter.utils.arxiv import get_categories, load_categories
+from django.core.management.base import BaseCommand, CommandParser
+
+
+class Command(BaseCommand):
+    help = "Loads the arxiv.org category tree into the database"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--crawl",
+            action="store_true",
+            help="Crawl arxiv.org for the tree instead of reading the saved copy",
+        )
+        parser.add_argument(
+            "--path", default="newsletter/utils/data/arxiv_topics.json"
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options["crawl"]:
+            categories = get_categories(path=options["path"])
+        else:
+            with open(options["path"], "r") as file:
+                categories = json.load(file)
+
+        ids = load_categories(categories)
+        self.stdout.write(self.style.SUCCESS(f"Loaded {len(ids)} categories"))
@@ -1,10 +1,46 @@
-from newsletter.utils.arxiv import get_papers
-from django.core.management.base import BaseCommand
+from newsletter.utils.arxiv import backfill_papers, get_papers
+from django.core.management.base import BaseCommand, CommandError, CommandParser
 
 
 class Command(BaseCommand):
     help = "Loads the arxiv.org papers into the database"
 
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--backfill",
+            action="store_true",
+            help="Harvest past papers from the OAI-PMH feed instead of today's listings",
+        )
+        parser.add_argument(
+            "--from", dest="from_date", help="First date to backfill (YYYY-MM-DD)"
+        )
+        parser.add_argument("--until", help="Last date to backfill (YYYY-MM-DD)")
+        parser.add_argument(
+            "--set", dest="set_spec", help="OAI set to backfill, e.g. 'cs'"
+        )
+        parser.add_argument("--checkpoint", help="Backfill checkpoint file")
+        return super().add_arguments(parser)
+
     def handle(self, *args, **options):
-        get_papers()
+        if options["backfill"]:
+            if not options["from_date"]:
+                raise CommandError("--backfill requires --from DATE")
+            created, updated = backfill_papers(
+                options["from_date"],
+                until=options["until"],
+                set_spec=options["set_spec"],
+                checkpoint_path=options["checkpoint"],
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Backfilled {created} new and {updated} updated papers"
+                )
+            )
+            return
+
+        stats = get_papers()
+        for stage in stats:
+            self.stdout.write(str(stage))
+            for item, error in stage.errors:
+                self.stderr.write(f"  {item}: {error}")
         self.stdout.write(self.style.SUCCESS("Load arxiv papers successfully"))
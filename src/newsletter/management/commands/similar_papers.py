@@ -0,0 +1,48 @@
+import time
+import datetime
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from newsletter.models import Paper
+from newsletter.tasks import compute_similar_papers, papers_added_on
+
+
+class Command(BaseCommand):
+    help = (
+        "Precomputes the similar papers of the papers added on a day, or of "
+        "every paper, in batches"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--date",
+            type=datetime.date.fromisoformat,
+            help="Day the papers were added, YYYY-MM-DD (default: yesterday)",
+        )
+        parser.add_argument("--all", action="store_true", help="Every paper")
+        parser.add_argument("-k", type=int, help="SIMILAR_PAPERS_K by default")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        papers = Paper.objects if options["all"] else papers_added_on(options["date"])
+        papers = papers.order_by("id")
+
+        updated, last_id, start = 0, 0, time.perf_counter()
+        while True:
+            ids = list(
+                papers.filter(id__gt=last_id).values_list("id", flat=True)[
+                    : options["batch_size"]
+                ]
+            )
+            if not ids:
+                break
+            updated += compute_similar_papers(ids, options["k"])
+            last_id = ids[-1]
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored the similar papers of {updated} papers in {elapsed:.1f}s"
+            )
+        )
@@ -0,0 +1,84 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from newsletter.models import PaperChunks
+from newsletter.utils.vector_index import NumpyVectorIndex
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds, compacts and benchmarks the NumPy vector index of the chunk "
+        "embeddings, used for search on databases without pgvector"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--directory", help="SEARCH_NUMPY_INDEX_DIR by default")
+        parser.add_argument(
+            "--rebuild", action="store_true", help="Index every stored chunk again"
+        )
+        parser.add_argument(
+            "--compact", action="store_true", help="Drop the replaced chunks' rows"
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--benchmark",
+            type=int,
+            default=0,
+            metavar="QUERIES",
+            help="Time this many searches for stored chunks",
+        )
+        parser.add_argument("-k", type=int, default=100)
+        return super().add_arguments(parser)
+
+    def batches(self, batch_size):
+        # Keyset pagination over the chunk ids, embeddings are large
+        chunks = PaperChunks.objects.order_by("pk").values_list(
+            "pk", "paper_id", "embedding"
+        )
+        last = None
+        while True:
+            page = chunks if last is None else chunks.filter(pk__gt=last)
+            rows = list(page[:batch_size])
+            if not rows:
+                return
+            chunk_ids, paper_ids, vectors = zip(*rows)
+            yield list(chunk_ids), list(paper_ids), np.array(vectors, dtype=np.float32)
+            last = rows[-1][0]
+
+    def handle(self, *args, **options):
+        index = NumpyVectorIndex(options["directory"])
+
+        if options["rebuild"]:
+            dimensions = PaperChunks._meta.get_field("embedding").dimensions
+            start = time.perf_counter()
+            rows = index.rebuild(self.batches(options["batch_size"]), dimensions)
+            self.stdout.write(
+                f"Indexed {rows} chunks in {time.perf_counter() - start:.1f}s"
+            )
+        elif options["compact"]:
+            self.stdout.write(f"Compacted to {index.compact()} rows")
+
+        meta = index.read_meta()
+        if meta is None:
+            raise CommandError(f"No vector index in {index.directory}, use --rebuild")
+        self.stdout.write(
+            f"{index.directory}: {meta['count'] - meta['deleted']} chunks "
+            f"({meta['deleted']} replaced) of {meta['dimensions']} dimensions"
+        )
+
+        if options["benchmark"]:
+            index.nearest(np.zeros(meta["dimensions"]), 1)
+            rows = np.flatnonzero(index.rows["paper"] >= 0)
+            rng = np.random.default_rng(0)
+            timings = []
+            for i in rng.choice(rows, min(options["benchmark"], len(rows)), False):
+                start = time.perf_counter()
+                index.nearest(index.vectors[i], options["k"])
+                timings.append(time.perf_counter() - start)
+            p50, p95 = np.percentile(timings, [50, 95]) * 1000
+            self.stdout.write(
+                f"top-{options['k']} over {len(rows)} chunks: "
+                f"p50 {p50:.2f} ms, p95 {p95:.2f} ms"
+            )
@@ -0,0 +1,91 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection
+
+from newsletter.models import PaperChunks
+
+
+# On-disk size of a pgvector value: 8 header bytes plus the components
+VECTOR_BYTES = {"embedding": 4, "embedding_half": 2}
+
+
+def top_k(vectors, query, k, exclude):
+    distances = np.linalg.norm(vectors - query, axis=1)
+    distances[exclude] = np.inf
+    return np.argsort(distances)[:k]
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports the storage used by the full and float16 chunk embeddings and "
+        "the recall@k of searching the float16 copy, with and without re-ranking"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("-k", type=int, default=10)
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument(
+            "--limit", type=int, default=20000, help="Chunks loaded for the recall run"
+        )
+        parser.add_argument("--rerank", type=int, help="Candidates per result")
+        return super().add_arguments(parser)
+
+    def handle(self, *args, **options):
+        self.report_sizes()
+
+        k, rerank = options["k"], options["rerank"] or settings.EMBEDDING_RERANK_FACTOR
+        embeddings = PaperChunks.objects.values_list("embedding", flat=True)
+        full = np.array(list(embeddings[: options["limit"]]), dtype=np.float32)
+        if len(full) <= k:
+            raise CommandError(f"Need more than {k} chunks, found {len(full)}")
+        half = full.astype(np.float16).astype(np.float32)
+
+        rng = np.random.default_rng(0)
+        queries = rng.choice(len(full), min(options["queries"], len(full)), False)
+        recall_half, recall_rerank = [], []
+        for i in queries:
+            exact = set(top_k(full, full[i], k, i))
+            candidates = top_k(half, full[i], k * rerank, i)
+            reranked = candidates[top_k(full[candidates], full[i], k, [])]
+            recall_half.append(len(exact & set(top_k(half, full[i], k, i))) / k)
+            recall_rerank.append(len(exact & set(reranked)) / k)
+
+        self.stdout.write(
+            f"recall@{k} over {len(queries)} queries on {len(full)} chunks:\n"
+            f"  float16 only: {np.mean(recall_half):.4f}\n"
+            f"  float16, top {k * rerank} re-ranked exactly: {np.mean(recall_rerank):.4f}"
+        )
+
+    def report_sizes(self):
+        chunks = PaperChunks.objects.count()
+        dimensions = PaperChunks._meta.get_field("embedding").dimensions
+        table = PaperChunks._meta.db_table
+
+        if connection.vendor != "postgresql":
+            self.stdout.write(f"{chunks} chunks, estimated column sizes:")
+            for column, size in VECTOR_BYTES.items():
+                total = chunks * (8 + size * dimensions)
+                self.stdout.write(f"  {column}: {total / 2**20:,.1f} MiB")
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT sum(pg_column_size(embedding)), "
+                f"sum(pg_column_size(embedding_half)) FROM {table}"
+            )
+            columns = dict(zip(VECTOR_BYTES, cursor.fetchone()))
+            cursor.execute(
+                "SELECT indexname, indexdef, "
+                "pg_relation_size(quote_ident(indexname)::regclass) "
+                "FROM pg_indexes WHERE tablename = %s",
+                [table],
+            )
+            indexes = cursor.fetchall()
+
+        self.stdout.write(f"{chunks} chunks in {table}:")
+        for column, size in columns.items():
+            self.stdout.write(f"  {column}: {(size or 0) / 2**20:,.1f} MiB")
+            for name, definition, index_size in indexes:
+                if f"({column} " in definition or f"({column})" in definition:
+                    self.stdout.write(f"    index {name}: {index_size / 2**20:,.1f} MiB")
@@ -0,0 +1,75 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("newsletter", "0004_category_tree"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestRun",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("listing_date", models.DateField()),
+                (
+                    "stage",
+                    models.CharField(
+                        choices=[
+                            ("fetch", "Fetch"),
+                            ("parse", "Parse"),
+                            ("persist", "Persist"),
+                            ("embed", "Embed"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=10,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("duration", models.FloatField(blank=True, null=True)),
+                ("error", models.TextField(blank=True, default="")),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ingest_runs",
+                        to="newsletter.category",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("category", "listing_date", "stage"),
+                        name="unique_category_listing_date_stage",
+                    )
+                ],
+            },
+        ),
+    ]
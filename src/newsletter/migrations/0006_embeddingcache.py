@@ -0,0 +1,40 @@
+from django.db import migrations, models
+import pgvector.django
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("newsletter", "0005_ingestrun"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmbeddingCache",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("model_id", models.CharField(max_length=255)),
+                ("text_hash", models.CharField(max_length=64)),
+                ("embedding", pgvector.django.VectorField()),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("model_id", "text_hash"),
+                        name="unique_model_id_text_hash",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+import pgvector.django
+
+
+def copy_embeddings(apps, schema_editor):
+    # Needs pgvector >= 0.7 for the halfvec type
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "UPDATE newsletter_paperchunks SET embedding_half = embedding::halfvec(384)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("newsletter", "0006_embeddingcache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paperchunks",
+            name="embedding_half",
+            field=pgvector.django.HalfVectorField(blank=True, dimensions=384, null=True),
+        ),
+        migrations.RunPython(copy_embeddings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("newsletter", "0007_paperchunks_embedding_half"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paperchunks",
+            name="model_version",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+    ]
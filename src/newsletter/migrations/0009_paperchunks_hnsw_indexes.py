@@ -0,0 +1,52 @@
+from django.db import migrations
+import pgvector.django
+
+
+INDEXES = [
+    pgvector.django.HnswIndex(
+        ef_construction=64,
+        fields=["embedding"],
+        m=16,
+        name="paperchunks_embedding_hnsw",
+        opclasses=["vector_l2_ops"],
+    ),
+    pgvector.django.HnswIndex(
+        ef_construction=64,
+        fields=["embedding_half"],
+        m=16,
+        name="paperchunks_half_hnsw",
+        opclasses=["halfvec_l2_ops"],
+    ),
+]
+
+
+def create_indexes(apps, schema_editor):
+    # HNSW is a pgvector access method, other databases search without index
+    if schema_editor.connection.vendor == "postgresql":
+        model = apps.get_model("newsletter", "PaperChunks")
+        for index in INDEXES:
+            schema_editor.add_index(model, index)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        model = apps.get_model("newsletter", "PaperChunks")
+        for index in INDEXES:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("newsletter", "0008_paperchunks_model_version"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_indexes, drop_indexes)],
+            state_operations=[
+                migrations.AddIndex(model_name="paperchunks", index=index)
+                for index in INDEXES
+            ],
+        ),
+    ]
@@ -0,0 +1,63 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+INDEX = django.contrib.postgres.indexes.GinIndex(
+    fields=["search_vector"], name="paper_search_vector_gin"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.add_index(apps.get_model("newsletter", "Paper"), INDEX)
+        # Same vector as PaperQuerySet.search_vector
+        schema_editor.execute(
+            "UPDATE newsletter_paper SET search_vector = "
+            "setweight(to_tsvector('english', coalesce(paper_number, '') || ' ' "
+            "|| coalesce(title, '')), 'A') "
+            "|| setweight(to_tsvector('english', coalesce(authors, '')), 'B') "
+            "|| setweight(to_tsvector('english', coalesce(abstract, '')), 'C')"
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE newsletter_paper_fts USING fts5("
+            "paper_number, title, authors, abstract, tokenize = 'porter unicode61')"
+        )
+        schema_editor.execute(
+            "INSERT INTO newsletter_paper_fts "
+            "(rowid, paper_number, title, authors, abstract) "
+            "SELECT id, paper_number, title, authors, abstract FROM newsletter_paper"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.remove_index(apps.get_model("newsletter", "Paper"), INDEX)
+    elif vendor == "sqlite":
+        schema_editor.execute("DROP TABLE newsletter_paper_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("newsletter", "0009_paperchunks_hnsw_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paper",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index)
+            ],
+            state_operations=[migrations.AddIndex(model_name="paper", index=INDEX)],
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("newsletter", "0010_paper_search_vector"),
+    ]
+
+    operations = [
+        # Old-style identifiers such as `cond-mat/0001001` exceed 15 characters
+        migrations.AlterField(
+            model_name="paper",
+            name="paper_number",
+            field=models.CharField(max_length=32, unique=True),
+        ),
+    ]
@@ -1,19 +1,29 @@
 # import hashid_field
 import uuid
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.urls import reverse
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
-from pgvector.django import VectorField
+from pgvector.django import HalfVectorField, HnswIndex, VectorField
 
 from ckeditor.fields import RichTextField
 
 from accounts.models import User
 
 # from . import signals
-from .querysets import PaperQuerySet
+from .querysets import (
+    CategoryQuerySet,
+    EmbeddingCacheQuerySet,
+    IngestRunQuerySet,
+    PaperChunksQuerySet,
+    PaperQuerySet,
+)
 
 
 class AbstractBaseModel(models.Model):
@@ -39,12 +49,30 @@ class Category(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     slug = models.SlugField(null=True, blank=True, unique=True)
 
+    # tree
+    parent = models.ForeignKey(
+        "self", related_name="children", on_delete=models.CASCADE, null=True, blank=True
+    )
+    # abbreviations of the category and its ancestors, root first,
+    # e.g: "grp_physics/astro-ph/astro-ph.GA/"
+    path = models.CharField(max_length=255, blank=True, default="")
+    depth = models.PositiveSmallIntegerField(default=0)
+
     # newsletters
     subscribers = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name="categories", through="Subscription")
 
-    class MPTTMeta:
-        order_insertion_by = ["name"]
+    objects = CategoryQuerySet.as_manager()
+
+    class Meta:
         verbose_name_plural = _("categories")
+        indexes = [
+            # varchar_pattern_ops lets Postgres use the index for prefix lookups
+            models.Index(
+                fields=["path"],
+                name="category_path_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
 
     def __str__(self):
         return str(self.name)
@@ -62,13 +90,14 @@ class Paper(models.Model):
     categories = models.ManyToManyField(Category, related_name="papers")
     title = models.CharField(max_length=255)
     authors = models.CharField(max_length=300)
-    paper_number = models.CharField(max_length=15, unique=True)
+    paper_number = models.CharField(max_length=32, unique=True)
     subjects = models.CharField(max_length=300, null=True)
     main_page = models.URLField(unique=True)
     is_visible = models.BooleanField(default=True)
     abstract = models.TextField()
     summary = models.TextField(null=True)
-    similar_papers = models.ManyToManyField("self")
+    # Nearest papers, precomputed in batches by the `similar_papers` command
+    similar_papers = models.ManyToManyField("self", symmetrical=False)
 
     # Access paper
     pdf_url = models.URLField(unique=True)
@@ -81,10 +110,17 @@ class Paper(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Full-text index on Postgres, see PaperQuerySet.update_search_index
+    search_vector = SearchVectorField(null=True, editable=False)
+
     objects = PaperQuerySet.as_manager()
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Created on Postgres only
+            GinIndex(fields=["search_vector"], name="paper_search_vector_gin"),
+        ]
 
     def __str__(self):
         return str(self.title)
@@ -92,7 +128,7 @@ class Paper(models.Model):
     def get_absolute_url(self):
         return reverse("newsletter:paper_detail", args=(self.paper_number,))
 
-    def save(self):
+    def save(self, *args, **kwargs):
         if not self.tex_source:
             self.tex_source = self.main_page.replace("pdf", "src")
         if not self.google_scholar:
@@ -101,7 +137,14 @@ class Paper(models.Model):
             self.semantic_scholar = (
                 f"https://api.semanticscholar.org/arXiv:{self.paper_number}"
             )
-        return super().save()
+        super().save(*args, **kwargs)
+        Paper.objects.db_manager(self._state.db).update_search_index([self.pk])
+
+
+@receiver(post_delete, sender=Paper)
+def remove_paper_from_search_index(sender, instance, using, **kwargs):
+    # Also runs for queryset deletes, which skip Paper.delete()
+    Paper.objects.db_manager(using).remove_from_search_index([instance.pk])
 
 
 class PaperChunks(AbstractBaseModel):
@@ -109,6 +152,32 @@ class PaperChunks(AbstractBaseModel):
     chunk = models.TextField()
     token_count = models.IntegerField(null=True)
     embedding = VectorField(dimensions=384)
+    # float16 copy of ``embedding`` searched first, see PaperChunksQuerySet
+    embedding_half = HalfVectorField(dimensions=384, null=True, blank=True)
+    # EMBEDDING_MODEL_VERSION the chunk was embedded with
+    model_version = models.CharField(max_length=255, blank=True, default="")
+
+    objects = PaperChunksQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Approximate nearest neighbour indexes for the L2 searches of
+            # PaperChunksQuerySet.nearest, created on Postgres only
+            HnswIndex(
+                fields=["embedding"],
+                name="paperchunks_embedding_hnsw",
+                m=16,
+                ef_construction=64,
+                opclasses=["vector_l2_ops"],
+            ),
+            HnswIndex(
+                fields=["embedding_half"],
+                name="paperchunks_half_hnsw",
+                m=16,
+                ef_construction=64,
+                opclasses=["halfvec_l2_ops"],
+            ),
+        ]
 
     def __str__(self):
         return f"{self.paper.title} - {self.chunk[:50]}"
@@ -144,4 +213,70 @@ class Subscription(AbstractBaseModel):
                 fields=["user", "category"],
                 name="unique_user_category",
             ),
-        ]
\ No newline at end of file
+        ]
+
+
+class IngestRun(AbstractBaseModel):
+    """Ledger of the ingest stages run for a category's daily listing."""
+
+    class StageChoice(models.TextChoices):
+        FETCH = "fetch", _("Fetch")
+        PARSE = "parse", _("Parse")
+        PERSIST = "persist", _("Persist")
+        EMBED = "embed", _("Embed")
+
+    class StatusChoice(models.TextChoices):
+        RUNNING = "running", _("Running")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, related_name="ingest_runs"
+    )
+    listing_date = models.DateField()
+    stage = models.CharField(max_length=10, choices=StageChoice.choices)
+    status = models.CharField(
+        max_length=10, choices=StatusChoice.choices, default=StatusChoice.RUNNING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # seconds spent in the stage on its last attempt
+    duration = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    objects = IngestRunQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["category", "listing_date", "stage"],
+                name="unique_category_listing_date_stage",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.category} {self.listing_date} {self.stage}: {self.status}"
+
+
+class EmbeddingCache(AbstractBaseModel):
+    """Embedding of a normalized text by a given model, reused across runs."""
+
+    model_id = models.CharField(max_length=255)
+    # sha256 of the normalized text
+    text_hash = models.CharField(max_length=64)
+    # Dimensions depend on the model
+    embedding = VectorField()
+
+    objects = EmbeddingCacheQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_id", "text_hash"],
+                name="unique_model_id_text_hash",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.model_id}: {self.text_hash}"
@@ -1,9 +1,480 @@
-from django.db import models
+import re
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections, models, transaction
+from django.db.models import Avg, Count, Exists, F, OuterRef, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from pgvector.django import L2Distance
+
+
+# SQLite allows a single writer at a time. Concurrent ingest workers take
+# turns instead of failing with "database is locked".
+_sqlite_writes = threading.RLock()
+
+
+def serialized_writes(using):
+    if connections[using].vendor == "sqlite":
+        return _sqlite_writes
+    return nullcontext()
+
+
+# pgvector rejects larger hnsw.ef_search values
+MAX_EF_SEARCH = 1000
+
+
+@contextmanager
+def ann_search(using, rows):
+    """
+    Runs the block in a transaction whose HNSW index scans can return up to
+    ``rows`` rows. An index scan stops after ``hnsw.ef_search`` rows (40 by
+    default), so a query with a larger LIMIT would silently get fewer.
+    """
+    if connections[using].vendor != "postgresql":
+        yield
+        return
+    ef_search = min(max(rows, settings.EMBEDDING_HNSW_EF_SEARCH), MAX_EF_SEARCH)
+    with transaction.atomic(using=using):
+        with connections[using].cursor() as cursor:
+            cursor.execute("SET LOCAL hnsw.ef_search = %d" % ef_search)
+        yield
+
+
+class CategoryQuerySet(models.QuerySet):
+
+    def descendants(self, category, include_self=True):
+        """Categories below ``category`` in the tree."""
+        categories = self.filter(path__startswith=category.path)
+        if not include_self:
+            categories = categories.exclude(pk=category.pk)
+        return categories
+
+
+def fts5_query(query):
+    """
+    SQLite FTS5 query matching the papers that contain every quoted phrase
+    and word of ``query``. Everything is quoted, so user input cannot use
+    FTS5 operators or break the query.
+    """
+    terms = [
+        phrase or word.replace('"', "")
+        for phrase, word in re.findall(r'"([^"]+)"|(\S+)', query)
+    ]
+    return " ".join(f'"{term}"' for term in terms if term.strip())
 
 
 class PaperQuerySet(models.QuerySet):
 
     use_for_related_fields = True
 
+    # Full-text index of the papers on SQLite, an FTS5 table created by
+    # migration 0010. Postgres uses the ``search_vector`` column instead.
+    fts_table = "newsletter_paper_fts"
+
+    # Paper fields refreshed when an already stored paper is listed again
+    upsert_fields = [
+        "title",
+        "authors",
+        "subjects",
+        "abstract",
+        "main_page",
+        "pdf_url",
+        "tex_source",
+        "google_scholar",
+        "semantic_scholar",
+        "updated_at",
+    ]
+
     def visible(self):
         return self.filter(is_visible=True)
+
+    def under(self, category):
+        """Papers listed in ``category`` or in any category below it."""
+        if not category.path:
+            return self.filter(categories=category)
+        return self.filter(categories__path__startswith=category.path).distinct()
+
+    def _from_listing(self, paper):
+        paper = self.model(
+            paper_number=paper["paper_number"],
+            title=paper["title"],
+            authors=paper["authors"],
+            subjects=paper.get("subjects"),
+            abstract=paper["abstract"],
+            main_page=paper["main_page"],
+            pdf_url=paper["pdf"],
+            tex_source=paper["tex_source"],
+            google_scholar=paper["google_scholar"],
+            semantic_scholar=paper["semantic_scholar"],
+        )
+        # An overlong value would fail the whole batch on Postgres
+        for name in ("title", "authors", "subjects"):
+            max_length = self.model._meta.get_field(name).max_length
+            value = getattr(paper, name)
+            if value and len(value) > max_length:
+                setattr(paper, name, value[:max_length])
+        return paper
+
+    def bulk_upsert(self, papers, category_ids=(), batch_size=500):
+        """
+        Inserts or updates listing ``papers`` keyed on ``paper_number`` and
+        links each of them to ``category_ids``.
+
+        Every batch costs a fixed number of queries whatever its size. Rows
+        are written with ``bulk_create`` so ``Paper.save`` and the
+        ``post_save`` signals are not run.
+
+        :param papers: list of paper dicts as returned by the listing parser,
+            optionally carrying their own ``category_ids``
+        :param category_ids: ids of the categories all the papers are listed in
+        :param batch_size: number of papers written per batch
+        :return: tuple of (created ids, updated ids)
+        """
+        # Postgres refuses to upsert the same row twice in one statement
+        papers = list({paper["paper_number"]: paper for paper in papers}.values())
+        through = self.model.categories.through
+
+        created_ids, updated_ids = [], []
+        with serialized_writes(self.db), transaction.atomic(using=self.db):
+            for i in range(0, len(papers), batch_size):
+                batch = papers[i : i + batch_size]
+                numbers = [paper["paper_number"] for paper in batch]
+
+                existing = set(
+                    self.filter(paper_number__in=numbers).values_list(
+                        "paper_number", flat=True
+                    )
+                )
+                self.bulk_create(
+                    [self._from_listing(paper) for paper in batch],
+                    update_conflicts=True,
+                    unique_fields=["paper_number"],
+                    update_fields=self.upsert_fields,
+                )
+                ids = dict(
+                    self.filter(paper_number__in=numbers).values_list(
+                        "paper_number", "id"
+                    )
+                )
+                through.objects.using(self.db).bulk_create(
+                    [
+                        through(
+                            paper_id=ids[paper["paper_number"]],
+                            category_id=category_id,
+                        )
+                        for paper in batch
+                        for category_id in {
+                            *category_ids,
+                            *paper.get("category_ids", ()),
+                        }
+                    ],
+                    ignore_conflicts=True,
+                )
+
+                self.update_search_index(ids.values())
+
+                for number, paper_id in ids.items():
+                    if number in existing:
+                        updated_ids.append(paper_id)
+                    else:
+                        created_ids.append(paper_id)
+        return created_ids, updated_ids
+
+    @staticmethod
+    def search_vector():
+        """Weighted tsvector of a paper, as stored in ``search_vector``."""
+        return (
+            SearchVector("paper_number", "title", weight="A", config="english")
+            + SearchVector("authors", weight="B", config="english")
+            + SearchVector("abstract", weight="C", config="english")
+        )
+
+    def update_search_index(self, ids):
+        """Refresh the full-text index entries of the papers ``ids``."""
+        ids = list(ids)
+        vendor = connections[self.db].vendor
+        if vendor == "postgresql":
+            self.filter(id__in=ids).update(search_vector=self.search_vector())
+        elif vendor == "sqlite" and ids:
+            placeholders = ", ".join(["%s"] * len(ids))
+            with serialized_writes(self.db), connections[self.db].cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {self.fts_table} WHERE rowid IN ({placeholders})",
+                    ids,
+                )
+                cursor.execute(
+                    f"INSERT INTO {self.fts_table} "
+                    f"(rowid, paper_number, title, authors, abstract) "
+                    f"SELECT id, paper_number, title, authors, abstract "
+                    f"FROM {self.model._meta.db_table} WHERE id IN ({placeholders})",
+                    ids,
+                )
+
+    def remove_from_search_index(self, ids):
+        """
+        Drop the full-text index entries of the deleted papers ``ids``. The
+        Postgres ``search_vector`` goes with the row, the SQLite FTS5 table
+        has to be cleaned up.
+        """
+        ids = list(ids)
+        if connections[self.db].vendor == "sqlite" and ids:
+            placeholders = ", ".join(["%s"] * len(ids))
+            with serialized_writes(self.db), connections[self.db].cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {self.fts_table} WHERE rowid IN ({placeholders})",
+                    ids,
+                )
+
+    def lexical_ranking(self, query, limit=100):
+        """
+        Ids of the papers matching the full-text ``query``, best first.
+        Quoted phrases must appear as they are, other words anywhere, and
+        matches in the paper number or title count most.
+        """
+        vendor = connections[self.db].vendor
+        if vendor == "postgresql":
+            search_query = SearchQuery(query, search_type="websearch", config="english")
+            return list(
+                self.filter(search_vector=search_query)
+                .annotate(rank=SearchRank(F("search_vector"), search_query))
+                .order_by("-rank", "id")
+                .values_list("id", flat=True)[:limit]
+            )
+        if vendor == "sqlite":
+            match = fts5_query(query)
+            if not match:
+                return []
+            with connections[self.db].cursor() as cursor:
+                # bm25 is lower for better matches, weighted per column
+                cursor.execute(
+                    f"SELECT rowid FROM {self.fts_table} "
+                    f"WHERE {self.fts_table} MATCH %s "
+                    f"ORDER BY bm25({self.fts_table}, 10.0, 10.0, 5.0, 1.0) LIMIT %s",
+                    [match, limit],
+                )
+                return [row[0] for row in cursor.fetchall()]
+        raise NotImplementedError(f"No full-text search on {vendor}")
+
+    def replace_similar_papers(self, neighbours, batch_size=500):
+        """
+        Swap the ``similar_papers`` of the papers in ``neighbours``, a dict
+        mapping paper ids to the ids of their similar papers, in bulk.
+        """
+        through = self.model.similar_papers.through.objects.using(self.db)
+        paper_ids = list(neighbours)
+        with serialized_writes(self.db), transaction.atomic(using=self.db):
+            for i in range(0, len(paper_ids), batch_size):
+                through.filter(from_paper_id__in=paper_ids[i : i + batch_size]).delete()
+            through.bulk_create(
+                [
+                    through.model(from_paper_id=paper_id, to_paper_id=similar_id)
+                    for paper_id, similar_ids in neighbours.items()
+                    for similar_id in similar_ids
+                ],
+                batch_size=batch_size,
+            )
+
+    def needing_embeddings(self, model_version):
+        """Papers without chunks or with chunks of another model version."""
+        chunks = self.model.chunks.rel.related_model.objects.filter(
+            paper=OuterRef("pk")
+        )
+        return self.filter(
+            ~Exists(chunks.filter(model_version=model_version))
+            | Exists(chunks.exclude(model_version=model_version))
+        )
+
+    def link_categories(self, paper_numbers, category_id):
+        """
+        Links already stored papers to ``category_id``.
+
+        :return: the paper numbers that matched no stored paper
+        """
+        ids = dict(
+            self.filter(paper_number__in=paper_numbers).values_list(
+                "paper_number", "id"
+            )
+        )
+        through = self.model.categories.through
+        with serialized_writes(self.db):
+            through.objects.using(self.db).bulk_create(
+                [
+                    through(paper_id=paper_id, category_id=category_id)
+                    for paper_id in ids.values()
+                ],
+                ignore_conflicts=True,
+            )
+        return [number for number in paper_numbers if number not in ids]
+
+
+class PaperChunksQuerySet(models.QuerySet):
+
+    def nearest(self, embedding, k=10, rerank=None):
+        """
+        The ``k`` chunks closest to ``embedding``, annotated with their L2
+        ``distance``.
+
+        With ``EMBEDDING_HALF_PRECISION`` on, the candidates are first taken
+        from the float16 ``embedding_half`` copy, then the top
+        ``k * rerank`` of them are re-ranked exactly on ``embedding``. Half
+        the bytes are scanned, and the result is exact as long as the true
+        top ``k`` are among the candidates.
+
+        :param rerank: candidates fetched per result, ``EMBEDDING_RERANK_FACTOR``
+            by default
+        """
+        if not settings.EMBEDDING_HALF_PRECISION:
+            return self.annotate(
+                distance=L2Distance("embedding", embedding)
+            ).order_by("distance")[:k]
+
+        rerank = rerank or settings.EMBEDDING_RERANK_FACTOR
+        candidates = self.order_by(L2Distance("embedding_half", embedding)).values(
+            "pk"
+        )[: k * rerank]
+        return (
+            self.filter(pk__in=candidates)
+            .annotate(distance=L2Distance("embedding", embedding))
+            .order_by("distance")[:k]
+        )
+
+    def best_per_paper(self, embedding, candidates=100):
+        """
+        The closest chunk of every paper among the ``candidates`` chunks
+        nearest to ``embedding``, best papers first.
+
+        Chunks are grouped by paper in the database with window functions,
+        only one row per paper is returned. Each chunk is annotated with its
+        ``distance``, the paper's ``score``, the mean distance of its chunks
+        among the candidates, and ``hits``, the number of those chunks.
+        """
+        nearest = self.nearest(embedding, k=candidates).values("pk")
+        paper = {"partition_by": [F("paper_id")]}
+        return (
+            self.filter(pk__in=nearest)
+            .annotate(distance=L2Distance("embedding", embedding))
+            .annotate(
+                score=Window(Avg("distance"), **paper),
+                hits=Window(Count("pk"), **paper),
+                rank=Window(RowNumber(), order_by=F("distance").asc(), **paper),
+            )
+            .filter(rank=1)
+            .order_by("score", "paper_id")
+        )
+
+    def replace(self, paper_ids, chunks, batch_size=500):
+        """Swap the chunks of ``paper_ids`` for ``chunks`` in one transaction."""
+        with serialized_writes(self.db), transaction.atomic(using=self.db):
+            self.filter(paper_id__in=paper_ids).delete()
+            return self.bulk_create(chunks, batch_size=batch_size)
+
+
+class IngestRunQuerySet(models.QuerySet):
+
+    def completed(self, listing_date):
+        """
+        :return: dict mapping category ids to the set of stages already
+            done for ``listing_date``
+        """
+        done = {}
+        runs = self.filter(
+            listing_date=listing_date, status=self.model.StatusChoice.DONE
+        ).values_list("category_id", "stage")
+        for category_id, stage in runs:
+            done.setdefault(category_id, set()).add(stage)
+        return done
+
+    def record_failure(self, category_id, listing_date, stage, error):
+        """
+        Records ``stage`` of a category's listing as failed with ``error``
+        without running it, e.g. when its task could not be queued.
+        """
+        with serialized_writes(self.db):
+            self.update_or_create(
+                category_id=category_id,
+                listing_date=listing_date,
+                stage=stage,
+                defaults={
+                    "status": self.model.StatusChoice.FAILED,
+                    "finished_at": timezone.now(),
+                    "error": repr(error),
+                },
+            )
+
+    @contextmanager
+    def track(self, category_id, listing_date, stage):
+        """
+        Records a run of ``stage`` for a category's listing, marking it done
+        when the block exits cleanly and failed, with the error, when it
+        raises.
+        """
+        with serialized_writes(self.db):
+            run, _ = self.update_or_create(
+                category_id=category_id,
+                listing_date=listing_date,
+                stage=stage,
+                defaults={
+                    "status": self.model.StatusChoice.RUNNING,
+                    "started_at": timezone.now(),
+                    "finished_at": None,
+                    "error": "",
+                },
+            )
+            self.filter(pk=run.pk).update(attempts=F("attempts") + 1)
+
+        start = time.perf_counter()
+        try:
+            yield run
+        except Exception as e:
+            run.status = self.model.StatusChoice.FAILED
+            run.error = repr(e)
+            raise
+        else:
+            run.status = self.model.StatusChoice.DONE
+        finally:
+            run.finished_at = timezone.now()
+            run.duration = time.perf_counter() - start
+            with serialized_writes(self.db):
+                run.save(
+                    update_fields=[
+                        "status",
+                        "error",
+                        "finished_at",
+                        "duration",
+                        "updated_at",
+                    ]
+                )
+
+
+class EmbeddingCacheQuerySet(models.QuerySet):
+
+    def lookup(self, model_id, text_hashes, batch_size=500):
+        """:return: dict mapping the cached ``text_hashes`` to their embedding"""
+        text_hashes = list(text_hashes)
+        found = {}
+        for i in range(0, len(text_hashes), batch_size):
+            found.update(
+                self.filter(
+                    model_id=model_id, text_hash__in=text_hashes[i : i + batch_size]
+                ).values_list("text_hash", "embedding")
+            )
+        return found
+
+    def store(self, model_id, embeddings, batch_size=500):
+        """
+        Caches ``embeddings``, a dict mapping text hashes to embeddings.
+        Hashes already cached are left as they are.
+        """
+        with serialized_writes(self.db):
+            self.bulk_create(
+                [
+                    self.model(model_id=model_id, text_hash=text_hash, embedding=vector)
+                    for text_hash, vector in embeddings.items()
+                ],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
@@ -1,19 +1,45 @@
 from celery import shared_task
+from celery.signals import worker_process_init
 from langchain.schema import Document
 
-from pgvector.django import L2Distance
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer
-
 from django.conf import settings
-from newsletter.models import Paper, PaperChunks
+from django.utils import timezone
+from newsletter.models import IngestRun, Paper
+from newsletter.utils.embeddings import EmbeddingEngine
+from newsletter.utils.model_registry import registry
 from newsletter.utils.pgvector_service import PgvectorService
+from newsletter.utils.search import HybridSearch
+from newsletter.utils.vector_index import get_vector_index
 
 import datetime
 
 
+@worker_process_init.connect
+def warm_up_models(**kwargs):
+    # Load the embedding models before the worker takes its first task
+    registry.warm_up()
+
+
 @shared_task(name="newsletter.embed_papers")
-def embed_papers(papers: list):
+def embed_papers(paper_ids: list, category_id=None, listing_date=None):
+    """
+    Upsert papers into the day's vector store collection. When called for
+    a category's listing, the run is recorded as its EMBED ingest stage.
+
+    :param listing_date: ISO date of the listing
+    """
+    if category_id is None:
+        return _embed_papers(paper_ids)
+    with IngestRun.objects.track(
+        category_id,
+        datetime.date.fromisoformat(listing_date),
+        IngestRun.StageChoice.EMBED,
+    ):
+        return _embed_papers(paper_ids)
+
+
+def _embed_papers(paper_ids):
+    papers = list(Paper.objects.filter(id__in=paper_ids))
     docs = [
         Document(
             paper.title + "\n" + paper.abstract,
@@ -25,105 +51,74 @@ def embed_papers(papers: list):
         for paper in papers
     ]
 
+    # Reruns on the same day only embed the papers that are new or changed
     pg_vectorstore = PgvectorService(settings.CONNECTION_STRING)
     pg_vectorstore.update_collection(
-        docs, collection_name=datetime.date.today().strftime("%d-%m-%Y")
+        docs,
+        collection_name=datetime.date.today().strftime("%d-%m-%Y"),
+        ids=[paper.id for paper in papers],
     )
+    return len(papers)
 
 
-class PaperSearchResult:
-    def __init__(self, score, paper, chunks):
-        self.score = score
-        self.paper = paper
-        self.chunks = chunks
+def get_query_embedding(query):
+    return registry.encode(query)
 
-    def __str__(self):
-        return f"{self.score}: {self.paper.title}"
 
+def generate_embeddings(paper: Paper):
+    EmbeddingEngine().save([paper])
 
-def get_query_embedding(query):
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    query_embedding = model.encode(query)
-    return query_embedding
 
+def generate_embeddings_batch(papers: list):
+    """Embed the chunks of many papers in large batches."""
+    return EmbeddingEngine().save(papers)
 
-def generate_embeddings(paper: Paper):
-    def get_chunks(content, chunk_size=750):
-        """Naive chunking of job description.
-
-        `chunk_size` is the number of characters per chunk.
-        """
-        chunk_size = chunk_size
-        while content:
-            chunk, content = content[:chunk_size], content[chunk_size:]
-            yield chunk
-
-    # 1. Set up the tokenizer model
-    tokenizer = AutoTokenizer.from_pretrained(
-        "sentence-transformers/all-MiniLM-L6-v2"
-    )
 
-    # 2. Chunk the paper description into sentences
-    chunk_embeddings = (
-        (c, tokenizer.tokenize(c), get_query_embedding(c))
-        for c in get_chunks(paper.title + "\n" + paper.abstract)
-    )
+def search(query=None, page=1):
+    query = query or "Creating effective LLM/AI agents"
+    # > expected result: page of papers in descending order of relevance
+    return HybridSearch().search(query, page)
 
-    # 3. Save the embeddings information for each chunk
-    paper_chunks = []
-    for chunk_content, chunk_tokens, chunk_embedding in chunk_embeddings:
-        paper_chunks.append(
-            PaperChunks(
-                paper=paper,
-                chunk=chunk_content,
-                token_count=len(chunk_tokens),
-                embedding=chunk_embedding,
-            )
-        )
 
-    PaperChunks.objects.bulk_create(paper_chunks)
+def compute_similar_papers(paper_ids, k=None):
+    """
+    Store the ``k`` nearest papers of each of ``paper_ids`` as its
+    ``similar_papers``, with one batched vector index search.
 
+    :return: number of papers updated
+    """
+    neighbours = get_vector_index().nearest_papers(
+        paper_ids,
+        k=k or settings.SIMILAR_PAPERS_K,
+        candidates=settings.SIMILAR_PAPERS_CANDIDATES,
+    )
+    Paper.objects.replace_similar_papers(neighbours)
+    return len(neighbours)
 
-@classmethod
-def search(query=None):
-    query = query or "Creating effective LLM/AI agents"
-    # > expected result: list of Job Descriptions in descending order of relevance
-    query_embedding = get_query_embedding(query)
 
-    paper_chunks = PaperChunks.objects.annotate(
-        distance=L2Distance("embedding", query_embedding)
-    ).order_by("distance")
+def papers_added_on(day=None):
+    """
+    Papers added on ``day``, by default yesterday, the last complete day
+    for a run after midnight.
+    """
+    day = day or timezone.localdate() - datetime.timedelta(days=1)
+    return Paper.objects.filter(created_at__date=day)
 
-    unique_papers = {}
-    for chunk in paper_chunks:
-        if chunk.paper.id not in unique_papers:
-            unique_papers[chunk.paper.id] = {
-                "paper": chunk.paper,
-                "chunks": [chunk],
-            }
-        else:
-            unique_papers[chunk.paper.id]["chunks"].append(chunk)
 
-    results = []
-    for k, v in unique_papers.items():
-        score = sum([c.distance for c in v["chunks"]]) / len(v["chunks"])
-        paper = v["paper"]
-        results.append(PaperSearchResult(score, paper, v["chunks"]))
+@shared_task(name="newsletter.update_similar_papers")
+def update_similar_papers(day=None, k=None):
+    """
+    Precompute the similar papers of the papers added on ``day`` (ISO
+    date, yesterday by default), whose chunks must be embedded already.
 
-    return sorted(results, key=lambda r: r.score)
+    The daily workflow runs the ``similar_papers`` command after the
+    ``embed_papers`` one instead; a django-celery-beat periodic task can
+    run this one on a Celery worker.
+    """
+    day = datetime.date.fromisoformat(day) if day else None
+    paper_ids = papers_added_on(day).values_list("id", flat=True)
+    return compute_similar_papers(list(paper_ids), k)
 
 
 def get_similar_papers(paper: Paper):
-    query_embedding = get_query_embedding(paper.title)
-
-    paper_chunks = PaperChunks.objects.annotate(
-        distance=L2Distance("embedding", query_embedding)
-    ).order_by("distance")[:3]
-
-    unique_papers = []
-    for chunk in paper_chunks:
-        if chunk.paper.id not in unique_papers:
-            unique_papers.append(chunk.paper)
-    
-    paper.similar_papers.add(unique_papers)
-    paper.save()
+    compute_similar_papers([paper.pk])
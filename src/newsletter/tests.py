@@ -0,0 +1,253 @@
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import requests
+from django.conf import settings
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+from newsletter.models import Category, IngestRun, Paper
+from newsletter.tasks import embed_papers
+from newsletter.utils.arxiv import get_papers
+from newsletter.utils.fetcher import FetchError, fetch_pages
+from newsletter.utils.oai import OAIHarvester
+from newsletter.utils.recordings import Recorder, ReplayServer
+
+try:
+    import onnxruntime  # noqa: F401
+    import sentence_transformers  # noqa: F401
+except ImportError:
+    onnxruntime = None
+
+
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+OAI_PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+<ListRecords>
+<record><metadata><arXiv xmlns="http://arxiv.org/OAI/arXiv/">
+<id>{number}</id><title>{title}</title>
+<authors><author><keyname>Doe</keyname><forenames>Jane</forenames></author></authors>
+<categories>cs.AI cs.LG</categories><abstract>An abstract.</abstract>
+</arXiv></metadata></record>
+<resumptionToken>{token}</resumptionToken>
+</ListRecords>
+</OAI-PMH>
+"""
+
+
+@override_settings(CACHES=LOCAL_CACHES, ARXIV_RATE_LIMIT=100, ARXIV_RATE_BURST=100)
+class FetchPagesTests(SimpleTestCase):
+    latency = 0.2
+    categories = ["cs.AI", "cs.CL", "cs.LG", "cs.CV"]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.fixtures = directory.name
+        recorder = Recorder(self.fixtures)
+        for category in self.categories:
+            recorder.save(f"/list/{category}/new", f"<html>{category}</html>")
+
+    def _urls(self, server):
+        return [f"{server.url}/list/{category}/new" for category in self.categories]
+
+    def test_pages_are_fetched_concurrently(self):
+        with ReplayServer(self.fixtures, self.latency) as server:
+            start = time.perf_counter()
+            pages = fetch_pages(self._urls(server), per_host=len(self.categories))
+            elapsed = time.perf_counter() - start
+        for url, category in zip(self._urls(server), self.categories):
+            self.assertEqual(pages[url].text, f"<html>{category}</html>")
+        # One after the other they would take a latency each
+        self.assertLess(elapsed, self.latency * len(self.categories) / 2)
+
+    def test_unchanged_page_is_served_from_the_cache(self):
+        with ReplayServer(self.fixtures) as server:
+            url = self._urls(server)[0]
+            first = fetch_pages([url])[url]
+            second = fetch_pages([url])[url]
+        self.assertFalse(first.not_modified)
+        self.assertTrue(second.not_modified)
+        self.assertEqual(second.text, first.text)
+        self.assertEqual(server.requests, 2)
+
+    def test_error_page_is_returned_as_exception(self):
+        with ReplayServer(self.fixtures) as server:
+            missing = f"{server.url}/list/math.AG/new"
+            urls = [missing, *self._urls(server)]
+            pages = fetch_pages(urls, retries=0)
+        self.assertIsInstance(pages[missing], FetchError)
+        self.assertTrue(all(page.text for page in list(pages.values())[1:]))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class OAIHarvesterTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.fixtures = os.path.join(directory.name, "recordings")
+        self.checkpoint = os.path.join(directory.name, "checkpoint.json")
+
+        # Both pages share the endpoint and differ by their query string only
+        recorder = Recorder(self.fixtures)
+        first = {"verb": "ListRecords", "metadataPrefix": "arXiv", "from": "2024-01-01"}
+        second = {"verb": "ListRecords", "resumptionToken": "2500|1001/cs"}
+        recorder.save(
+            self._url("http://export.arxiv.org/oai2", first),
+            OAI_PAGE.format(number="2401.00001", title="First", token="2500|1001/cs"),
+        )
+        recorder.save(
+            self._url("http://export.arxiv.org/oai2", second),
+            OAI_PAGE.format(number="cond-mat/0001001", title="Second", token=""),
+        )
+
+    @staticmethod
+    def _url(base_url, params):
+        return requests.Request("GET", base_url, params=params).prepare().url
+
+    def _harvester(self, server):
+        return OAIHarvester(self.checkpoint, base_url=f"{server.url}/oai2", retries=0)
+
+    def test_harvest_resumes_from_checkpoint(self):
+        with ReplayServer(self.fixtures) as server:
+            pages = self._harvester(server).pages("2024-01-01")
+            first = next(pages)
+            second = next(pages)
+            # Interrupted before the second page was processed
+            pages.close()
+            self.assertEqual([paper["title"] for paper in first], ["First"])
+            self.assertEqual(second[0]["paper_number"], "cond-mat/0001001")
+            self.assertEqual(server.requests, 2)
+
+            resumed = list(self._harvester(server).pages("2024-01-01"))
+            self.assertEqual(
+                [[paper["title"] for paper in page] for page in resumed], [["Second"]]
+            )
+            self.assertEqual(server.requests, 3)
+
+            # A completed harvest is not fetched again
+            self.assertEqual(list(self._harvester(server).pages("2024-01-01")), [])
+            self.assertEqual(server.requests, 3)
+
+
+@override_settings(CACHES=LOCAL_CACHES, ARXIV_RATE_LIMIT=100, ARXIV_RATE_BURST=100)
+class GetPapersTests(TransactionTestCase):
+    # Pipeline stages write from their own threads
+    abbrv = "q-bio.BM"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.snapshots = directory.name
+        # Data migrations may have loaded the category tree already
+        self.topic, _ = Category.objects.get_or_create(
+            abbrv=self.abbrv,
+            defaults={"name": "Biomolecules", "path": f"{self.abbrv}/"},
+        )
+
+    def _get_papers(self, server):
+        with override_settings(ARXIV_BASE_URL=server.url):
+            return get_papers(limit=5, path=self.snapshots, abbrvs=[self.abbrv])
+
+    def _stages(self):
+        return dict(
+            IngestRun.objects.filter(category=self.topic).values_list(
+                "stage", "status"
+            )
+        )
+
+    def test_unqueued_embedding_is_queued_by_the_next_run(self):
+        with ReplayServer(settings.ARXIV_RECORDINGS) as server:
+            with mock.patch.object(
+                embed_papers, "delay", side_effect=ConnectionError("no broker")
+            ), self.assertLogs("newsletter.utils.arxiv", "ERROR"):
+                self._get_papers(server)
+            stages = self._stages()
+            self.assertEqual(stages["persist"], IngestRun.StatusChoice.DONE)
+            self.assertEqual(stages["embed"], IngestRun.StatusChoice.FAILED)
+            self.assertEqual(Paper.objects.filter(categories=self.topic).count(), 5)
+
+            with mock.patch.object(embed_papers, "delay") as delay:
+                self._get_papers(server)
+            # The persisted listing is not fetched again
+            self.assertEqual(server.requests, 1)
+
+        paper_ids, category_id, listing_date = delay.call_args.args
+        self.assertCountEqual(paper_ids, Paper.objects.values_list("id", flat=True))
+        self.assertEqual(category_id, self.topic.id)
+
+
+class PaperSearchIndexTests(TestCase):
+    def setUp(self):
+        self.paper = Paper.objects.create(
+            title="Sparse attention for long documents",
+            authors="Jane Doe",
+            paper_number="2401.00001",
+            main_page="https://arxiv.org/abs/2401.00001",
+            pdf_url="https://arxiv.org/pdf/2401.00001",
+            abstract="We study attention.",
+        )
+
+    def test_save_updates_the_index(self):
+        self.paper.title = "Dense retrieval"
+        self.paper.save(update_fields=["title"])
+        self.assertEqual(Paper.objects.lexical_ranking("retrieval"), [self.paper.id])
+        self.assertEqual(Paper.objects.lexical_ranking("sparse"), [])
+
+    def test_delete_removes_the_index_entry(self):
+        other = Paper.objects.create(
+            title="Sparse mixtures of experts",
+            authors="John Roe",
+            paper_number="cond-mat/0001001",
+            main_page="https://arxiv.org/abs/cond-mat/0001001",
+            pdf_url="https://arxiv.org/pdf/cond-mat/0001001",
+            abstract="Experts.",
+        )
+        self.paper.delete()
+        self.assertEqual(Paper.objects.lexical_ranking("sparse"), [other.id])
+        Paper.objects.filter(id=other.id).delete()
+        self.assertEqual(Paper.objects.lexical_ranking("sparse"), [])
+
+
+PARITY_TEXTS = [
+    "Attention is all you need",
+    "We propose a graph neural network for molecular property prediction.",
+    "Diffusion models generate images by reversing a noising process, and "
+    "we show how to sample from them in a few steps.",
+    "cond-mat/0001001",
+]
+
+
+@unittest.skipIf(onnxruntime is None, "onnxruntime and sentence-transformers needed")
+class OnnxParityTests(SimpleTestCase):
+    # Same bound as `benchmark_onnx --min-cosine`
+    min_cosine = 0.99
+
+    def test_onnx_embeddings_match_torch(self):
+        from sentence_transformers import SentenceTransformer
+
+        from newsletter.utils.onnx_encoder import OnnxEncoder, export_onnx
+
+        model = SentenceTransformer(settings.EMBEDDING_MODEL, device="cpu")
+        expected = model.encode(PARITY_TEXTS)
+        with tempfile.TemporaryDirectory() as directory:
+            export_onnx(model, directory, quantize=True)
+            for quantized in (False, True):
+                with self.subTest(quantized=quantized):
+                    encoder = OnnxEncoder(directory, quantized=quantized)
+                    embeddings = encoder.encode(PARITY_TEXTS, batch_size=2)
+                    self.assertEqual(embeddings.shape, expected.shape)
+                    cosine = np.sum(expected * embeddings, axis=1) / (
+                        np.linalg.norm(expected, axis=1)
+                        * np.linalg.norm(embeddings, axis=1)
+                    )
+                    self.assertGreaterEqual(cosine.min(), self.min_cosine)
@@ -1,46 +1,31 @@
 import json
 import os
-import tqdm
 import json
 import pytz
-import random
-import requests
+import logging
 import datetime
 import threading
-import urllib.request
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
+from django.conf import settings
 from django.db import transaction
+from django.utils.text import slugify
 
-from newsletter.models import Category, Paper
+from newsletter.models import Category, IngestRun, Paper
 from newsletter.tasks import embed_papers
+from newsletter.utils.fetcher import ArxivFetcher, fetch_page, fetch_pages
+from newsletter.utils.http_cache import HttpCache
+from newsletter.utils.oai import OAIHarvester
+from newsletter.utils.parsers import get_listing_parser
+from newsletter.utils.pipeline import Pipeline, Stage
+from newsletter.utils.snapshots import SnapshotWriter, read_snapshot
 
 
-user_agents = [
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
-    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
-    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:78.0) Gecko/20100101 Firefox/78.0",
-    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:78.0) Gecko/20100101 Firefox/78.0",
-    "Mozilla/5.0 (X11; Linux i686; rv:78.0) Gecko/20100101 Firefox/78.0",
-    "Mozilla/5.0 (Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0",
-    "Mozilla/5.0 (X11; Ubuntu; Linux i686; rv:78.0) Gecko/20100101 Firefox/78.0",
-    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0",
-    "Mozilla/5.0 (X11; Fedora; Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0",
-    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; Trident/7.0; rv:11.0) like Gecko",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36 Edg/84.0.522.44",
-    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36 Edg/84.0.522.44",
-]
+logger = logging.getLogger(__name__)
 
 
-def get_sub_categories(url="https://arxiv.org/archive/q-bio"):
-    response = requests.get(
-        url, headers={"User-Agent": random.choice(user_agents)}
-    )
-    soup = BeautifulSoup(response.text, "html.parser")
+def _parse_sub_categories(page):
+    soup = BeautifulSoup(page, "html.parser")
 
     subsubfields_list = []
     try:
@@ -62,12 +47,14 @@ def get_sub_categories(url="https://arxiv.org/archive/q-bio"):
     return subsubfields_list
 
 
+def get_sub_categories(url="https://arxiv.org/archive/q-bio"):
+    return _parse_sub_categories(fetch_page(url).text)
+
+
 def get_categories(
     url="https://www.arxiv.org", path="newsletter/utils/data/arxiv_topics.json"
 ):
-    response = urllib.request.urlopen(
-        url, headers={"User-Agent": random.choice(user_agents)}
-    )
+    response = fetch_page(url)
     soup = BeautifulSoup(response.text, "html.parser")
 
     fields = soup.select("main div#content h2")[:-1]
@@ -79,12 +66,11 @@ def get_categories(
         for f in subfields:
             sub = f.select_one("a")
             abbrv = f.select_one("strong").get("id")
-            main_url = urljoin(url, f"/archive/{abbrv}")
             subfields_list.append(
                 {
                     "name": sub.text,
                     "abbrv": abbrv,
-                    "sub_fields": get_sub_categories(main_url),
+                    "sub_fields": [],
                 }
             )
 
@@ -95,153 +81,346 @@ def get_categories(
             }
         )
 
+    # Crawl every archive page concurrently, unchanged pages come back as 304s
+    archives = {
+        urljoin(url, f"/archive/{sub['abbrv']}"): sub
+        for field in fields_list
+        for sub in field["sub_fields"]
+    }
+    for archive_url, page in fetch_pages(archives).items():
+        if isinstance(page, Exception):
+            logger.error("Could not crawl %s: %s", archive_url, page)
+            continue
+        archives[archive_url]["sub_fields"] = _parse_sub_categories(page.text)
+
     with open(path, "w") as file:
         json_data = json.dumps(fields_list, indent=4)
         file.write(json_data)
     return fields_list
 
 
-def load_categories(categories: list, parent_field=None):
+def _flatten_categories(categories, parent=None):
     for field in categories:
-        topic, _ = Category.objects.get_or_create(
-            name=field["name"], abbrv=field.get("abbrv", None)
+        # Top level groups such as "Physics" have no arXiv abbreviation
+        abbrv = field.get("abbrv") or f"grp_{slugify(field['name'])}"
+        path = f"{parent['path'] if parent else ''}{abbrv}/"
+        node = {
+            "name": field["name"],
+            "abbrv": abbrv,
+            "parent": parent["abbrv"] if parent else None,
+            "path": path,
+            "depth": parent["depth"] + 1 if parent else 0,
+        }
+        yield node
+        yield from _flatten_categories(field.get("sub_fields", []), node)
+
+
+def load_categories(categories: list):
+    """
+    Bulk loads the category tree returned by ``get_categories``, storing
+    each category's parent and ancestor path.
+
+    Existing categories, matched on ``abbrv``, are updated in place and keep
+    their slug.
+    """
+    nodes = list(_flatten_categories(categories))
+    slugs = dict(Category.objects.values_list("abbrv", "slug"))
+    taken = set(slugs.values())
+
+    rows = []
+    for node in nodes:
+        slug = slugs.get(node["abbrv"])
+        if not slug:
+            # Groups share their name with an archive ("Physics") and aliases
+            # such as math.ST and stat.TH share the same name
+            slug = slugify(node["name"])
+            if node["depth"] == 0 or slug in taken:
+                slug = slugify(node["abbrv"].replace(".", "-"))
+            taken.add(slug)
+        rows.append(
+            Category(
+                name=node["name"],
+                abbrv=node["abbrv"],
+                slug=slug,
+                path=node["path"],
+                depth=node["depth"],
+            )
         )
 
-
-def _download_new_papers(field_abbr, path):
-    NEW_SUB_URL = (
-        f"https://arxiv.org/list/{field_abbr}/new"  # https://arxiv.org/list/cs/new
-    )
-    page = urllib.request.urlopen(
-        NEW_SUB_URL, headers={"User-Agent": random.choice(user_agents)}
-    )
-    soup = BeautifulSoup(page, "html.parser")
-    content = soup.body.find("div", {"id": "content"})
-
-    # find the first h3 element in content
-    h3 = content.find("h3").text  # e.g: New submissions for Wed, 10 May 23
-    date = h3.replace("New submissions for", "").strip()
-
-    dt_list = content.dl.find_all("dt")
-    dd_list = content.dl.find_all("dd")
-    arxiv_base = "https://arxiv.org/abs/"
-
-    assert len(dt_list) == len(dd_list)
-    new_paper_list = []
-    for i in tqdm.tqdm(range(len(dt_list))):
-        paper = {}
-        paper_number = dt_list[i].text.strip().split(" ")[2].split(":")[-1]
-        paper["main_page"] = arxiv_base + paper_number
-        paper["pdf"] = arxiv_base.replace("abs", "pdf") + paper_number
-        paper["tex_source"] = arxiv_base.replace("abs", "src") + paper_number
-
-        paper["title"] = (
-            dd_list[i]
-            .find("div", {"class": "list-title mathjax"})
-            .text.replace("Title: ", "")
-            .strip()
-        )
-        paper["authors"] = (
-            dd_list[i]
-            .find("div", {"class": "list-authors"})
-            .text.replace("Authors:\n", "")
-            .replace("\n", "")
-            .strip()
-        )
-        paper["subjects"] = (
-            dd_list[i]
-            .find("div", {"class": "list-subjects"})
-            .text.replace("Subjects: ", "")
-            .strip()
-        )
-        paper["abstract"] = (
-            dd_list[i].find("p", {"class": "mathjax"}).text.replace("\n", " ").strip()
+    abbrvs = [node["abbrv"] for node in nodes]
+    with transaction.atomic():
+        Category.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["abbrv"],
+            update_fields=["name", "path", "depth", "updated_at"],
         )
-        paper["paper_number"] = paper_number
-        paper["google_scholar"] = (
-            f"https://scholar.google.com/scholar_lookup?arxiv_id={paper_number}"
+        ids = dict(
+            Category.objects.filter(abbrv__in=abbrvs).values_list("abbrv", "id")
         )
-        paper["semantic_scholar"] = (
-            f"https://api.semanticscholar.org/arXiv:{paper_number}"
+        Category.objects.bulk_update(
+            [
+                Category(id=ids[node["abbrv"]], parent_id=ids.get(node["parent"]))
+                for node in nodes
+            ],
+            ["parent"],
         )
-        new_paper_list.append(paper)
+    return ids
+
 
-    #  check if ./data exist, if not, create it
-    if not os.path.exists(path):
-        os.makedirs(path)
+def _listing_url(field_abbr):
+    # e.g: https://arxiv.org/list/cs/new
+    return urljoin(settings.ARXIV_BASE_URL, f"/list/{field_abbr}/new")
 
-    # save new_paper_list to a jsonl file, with each line as the element of a dictionary
-    date = datetime.date.fromtimestamp(
+
+def _listing_day():
+    return datetime.date.fromtimestamp(
         datetime.datetime.now(tz=pytz.timezone("America/New_York")).timestamp()
     )
-    date = date.strftime("%a, %d %b %y")
-    with open(f"{path}/{field_abbr}_{date}.jsonl", "w") as file:
-        json_data = json.dumps(new_paper_list, indent=4)
-        file.write(json_data)
+
+
+def _listing_date():
+    return _listing_day().strftime("%a, %d %b %y")
+
+
+def _parse_new_papers(page):
+    return get_listing_parser().parse(page)
+
+
+def _snapshot_path(path, field_abbr):
+    return f"{path}/{field_abbr}_{_listing_date()}.jsonl.gz"
+
+
+def _save_new_papers(new_paper_list, field_abbr, path):
+    # save new_paper_list to a compressed jsonl snapshot, one paper per line
+    SnapshotWriter(_snapshot_path(path, field_abbr)).write(new_paper_list)
     return new_paper_list
 
 
-def load_papers(result, topic_id):
-    new_papers = []
-    with transaction.atomic():
-        for paper_data in result:
-            # Create or get the Paper object within an atomic transaction
-            paper, created = Paper.objects.get_or_create(
-                authors=paper_data["authors"],
-                title=paper_data["title"],
-                main_page=paper_data["main_page"],
-                pdf_url=paper_data["pdf"],
-                tex_source=paper_data["tex_source"],
-                abstract=paper_data["abstract"],
-                paper_number=paper_data["paper_number"],
-                semantic_scholar=paper_data["semantic_scholar"],
-                google_scholar=paper_data["google_scholar"],
-            )
-            # Assign the topic to the Paper object
-            paper.topics.add(topic_id)
-            paper.save()
+def _read_listing(page):
+    # A 304 hands back the papers parsed from the cached copy of the page
+    if page.not_modified and page.parsed is not None:
+        return page.parsed
+    new_paper_list = _parse_new_papers(page.text)
+    HttpCache().set_parsed(page.url, new_paper_list)
+    return new_paper_list
 
-            if created:
-                new_papers.append(paper)
 
-    print(f"Saved {len(new_papers)} new papers with topic id: {topic_id}")
-    embed_papers.s(new_papers)
-    return result
+def _download_new_papers(field_abbr, path):
+    page = fetch_page(_listing_url(field_abbr))
+    return _save_new_papers(_read_listing(page), field_abbr, path)
+
+
+class ListingMerger:
+    """
+    Tracks the papers seen across all listings of a run, so that a
+    cross-listed paper is written once and only linked to the other
+    categories it appears in.
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def add(self, topic_id, papers):
+        """
+        :return: tuple of (papers not seen before, papers already seen in
+            another listing)
+        """
+        new, cross_listed = [], []
+        with self.lock:
+            for paper in papers:
+                number = paper["paper_number"]
+                if number in self.seen:
+                    cross_listed.append(paper)
+                else:
+                    self.seen.add(number)
+                    new.append(paper)
+        return new, cross_listed
+
+
+def load_papers(result, topic_id=None):
+    """
+    Upsert listing papers, linked to the topic when given.
+
+    :return: ids of the papers created or updated
+    """
+    created_ids, updated_ids = Paper.objects.bulk_upsert(
+        result, category_ids=[topic_id] if topic_id else []
+    )
 
+    logger.info(
+        "Saved %s new and %s updated papers", len(created_ids), len(updated_ids)
+    )
+    return created_ids + updated_ids
+
+
+def queue_embedding(paper_ids, topic_id, listing_day):
+    """
+    Queue the embedding of a listing's papers, which the task records as
+    the EMBED stage of the topic's ``listing_day``. When the broker cannot
+    be reached the EMBED run is recorded failed here instead, so the next
+    ``get_papers`` queues it again.
+    """
+    if not paper_ids:
+        return
+    try:
+        embed_papers.delay(paper_ids, topic_id, listing_day.isoformat())
+    except Exception as e:
+        logger.exception("Queueing the embedding of category %s failed", topic_id)
+        IngestRun.objects.record_failure(
+            topic_id, listing_day, IngestRun.StageChoice.EMBED, e
+        )
 
-def get_papers(limit=None, path="newsletter/utils/data/papers"):
 
-    results = []
+def _listing_paper_ids(path, topic, limit=None):
+    # Ids of the papers of a listing persisted by an earlier run
+    snapshot = _snapshot_path(path, topic.abbrv)
+    if not os.path.exists(snapshot):
+        logger.warning("No snapshot of %s left to embed its papers from", topic)
+        return []
+    numbers = [
+        paper["paper_number"] for paper in read_snapshot(snapshot, limit=limit)
+    ]
+    return list(
+        Paper.objects.filter(paper_number__in=numbers).values_list("id", flat=True)
+    )
 
-    topics = Category.objects.all()
-    threads = []
 
-    for topic in topics:
-        if topic.abbrv:
-            date = datetime.date.fromtimestamp(
-                datetime.datetime.now(tz=pytz.timezone("America/New_York")).timestamp()
+def get_papers(limit=None, path="newsletter/utils/data/papers", abbrvs=None):
+    """
+    Loads today's new submissions of every category through a
+    fetch -> parse -> normalize -> persist pipeline.
+
+    Every stage run is recorded in the ``IngestRun`` ledger. Categories
+    already persisted for the day are skipped and a category whose listing
+    was parsed is read back from its snapshot, so a rerun only redoes the
+    stages that failed. The embedding of every persisted listing is queued
+    once all listings are persisted, again on reruns until it is done.
+
+    :param limit: maximum number of papers loaded per category
+    :param abbrvs: abbreviations of the categories to load, all by default
+
+    :return: list of ``StageStats``, one per stage
+    """
+    listing_day = _listing_day()
+    done = IngestRun.objects.completed(listing_day)
+    # Parent archives list their children's papers, only fetch the leaves
+    categories = Category.objects.filter(children__isnull=True)
+    if abbrvs is not None:
+        categories = categories.filter(abbrv__in=abbrvs)
+    topics, unembedded = [], []
+    for topic in categories:
+        stages = done.get(topic.id, ())
+        if not topic.abbrv:
+            continue
+        if IngestRun.StageChoice.PERSIST not in stages:
+            topics.append(topic)
+        elif IngestRun.StageChoice.EMBED not in stages:
+            # Persisted by an earlier run, its embedding failed or never ran
+            unembedded.append(topic)
+    merger = ListingMerger()
+    # Ids of the papers persisted, by topic
+    persisted = {}
+    # Cross-listed papers whose row did not exist yet when they were linked,
+    # by topic. The other listing may still be persisting them, or have failed.
+    unlinked = {}
+
+    def track(topic, stage):
+        return IngestRun.objects.track(topic.id, listing_day, stage)
+
+    def fetch(topic):
+        snapshot = _snapshot_path(path, topic.abbrv)
+        parsed = IngestRun.StageChoice.PARSE in done.get(topic.id, ())
+        if parsed and os.path.exists(snapshot):
+            return topic, None
+        with track(topic, IngestRun.StageChoice.FETCH):
+            return topic, fetcher.get(_listing_url(topic.abbrv))
+
+    def parse(item):
+        topic, page = item
+        if page is None:
+            snapshot = _snapshot_path(path, topic.abbrv)
+            return topic, list(read_snapshot(snapshot, limit=limit))
+        with track(topic, IngestRun.StageChoice.PARSE):
+            papers = _save_new_papers(_read_listing(page), topic.abbrv, path)
+        return topic, papers[:limit]
+
+    def normalize(item):
+        topic, papers = item
+        return topic, *merger.add(topic.id, papers)
+
+    def persist(item):
+        topic, papers, cross_listed = item
+        with track(topic, IngestRun.StageChoice.PERSIST):
+            paper_ids = load_papers(papers, topic.id)
+            missing = set(
+                Paper.objects.link_categories(
+                    [paper["paper_number"] for paper in cross_listed], topic.id
+                )
             )
-            date = date.strftime("%a, %d %b %y")
-            if not os.path.exists(f"{path}/{topic.abbrv}_{date}.jsonl"):
-                result = _download_new_papers(topic.abbrv, path)
-            else:
-                result = []
-                with open(f"{path}/{topic.abbrv}_{date}.jsonl", "r") as f:
-                    result = json.load(f)
-                    # for i, line in enumerate(f.readlines()):
-                    #     if limit and i == limit:
-                    #         return result
-                    #     result.append(json.loads(line))
-            results + result
-
-            thread = threading.Thread(target=load_papers, args=(result, topic.id))
-            threads.append(thread)
-            thread.start()
-
-    for thread in threads:
-        thread.join()
-
-    return results
+        persisted[topic] = paper_ids
+        if missing:
+            unlinked[topic] = [
+                paper for paper in cross_listed if paper["paper_number"] in missing
+            ]
+
+    workers = settings.ARXIV_PIPELINE_WORKERS
+    pipeline = Pipeline(
+        [
+            Stage("fetch", fetch, workers["fetch"]),
+            Stage("parse", parse, workers["parse"]),
+            Stage("normalize", normalize, workers["normalize"]),
+            Stage("persist", persist, workers["persist"]),
+        ],
+        maxsize=settings.ARXIV_PIPELINE_QUEUE_SIZE,
+    )
+    with ArxivFetcher() as fetcher:
+        pipeline.run(topics)
+
+    # Every listing has been persisted or has failed by now. Upserting the
+    # missing papers links them whichever happened, and a failure leaves the
+    # topic's PERSIST run failed so that a rerun redoes it.
+    for topic, papers in unlinked.items():
+        try:
+            with track(topic, IngestRun.StageChoice.PERSIST):
+                persisted[topic] += load_papers(papers, topic.id)
+        except Exception:
+            logger.exception("Linking the cross-listed papers of %s failed", topic)
+            # Its rerun persists and queues the whole listing again
+            del persisted[topic]
+
+    # Queued outside of the PERSIST runs, an unreachable broker only fails EMBED
+    for topic in unembedded:
+        persisted[topic] = _listing_paper_ids(path, topic, limit)
+    for topic, paper_ids in persisted.items():
+        queue_embedding(paper_ids, topic.id, listing_day)
+    return pipeline.stats
+
+
+def backfill_papers(from_date, until=None, set_spec=None, checkpoint_path=None):
+    """
+    Harvests papers from arXiv's OAI-PMH feed into the database, one
+    ``ListRecords`` page per bulk write. An interrupted backfill picks up
+    from its last checkpoint when run again with the same arguments.
+
+    :return: tuple of (number of papers created, number of papers updated)
+    """
+    category_ids = dict(Category.objects.values_list("abbrv", "id"))
+    harvester = OAIHarvester(checkpoint_path or settings.ARXIV_OAI_CHECKPOINT)
+
+    created, updated = 0, 0
+    for papers in harvester.pages(from_date, until, set_spec):
+        for paper in papers:
+            paper["category_ids"] = [
+                category_ids[abbrv]
+                for abbrv in paper["categories"]
+                if abbrv in category_ids
+            ]
+        created_ids, updated_ids = Paper.objects.bulk_upsert(papers)
+        created += len(created_ids)
+        updated += len(updated_ids)
+    return created, updated
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from newsletter.utils.model_registry import registry
+
+
+SENTENCE_ENDINGS = ".!?"
+
+
+@dataclass
+class Chunk:
+    text: str
+    # Character offsets of the chunk in the source text
+    start: int
+    end: int
+    token_count: int
+
+
+class TokenChunker:
+    """
+    Splits texts into chunks that fit the token window of a model.
+
+    Every text is tokenized once, with offset mapping, and chunks are cut
+    on token boundaries from those offsets, so their token counts come for
+    free. A chunk ends on the last sentence boundary of its window when
+    there is one, and never in the middle of a word unless the word alone
+    overflows the window.
+
+    :param name: model whose tokenizer and window are used
+    :param max_tokens: tokens per chunk, the model window by default
+    :param overlap: tokens repeated at the start of the next chunk
+    :param sentences: whether to prefer cutting on sentence boundaries
+    """
+
+    def __init__(self, name=None, max_tokens=None, overlap=None, sentences=True):
+        self.name = name or settings.EMBEDDING_MODEL
+        model = registry.get(self.name)
+        # Leave room for the [CLS]/[SEP] tokens added when encoding
+        window = model.max_seq_length - model.tokenizer.num_special_tokens_to_add()
+        self.max_tokens = min(max_tokens or window, window)
+        overlap = settings.EMBEDDING_CHUNK_OVERLAP if overlap is None else overlap
+        self.overlap = min(overlap, self.max_tokens // 2)
+        self.sentences = sentences
+
+    def split(self, text):
+        return self.split_many([text])[0]
+
+    def split_many(self, texts):
+        """:return: a list of ``Chunk`` per text, tokenizing all texts at once"""
+        encodings = registry.batch_tokenize(
+            texts, self.name, return_offsets_mapping=True
+        )
+        return [
+            self._pack(text, offsets)
+            for text, offsets in zip(texts, encodings["offset_mapping"])
+        ]
+
+    def _pack(self, text, offsets):
+        def joined(i):
+            # Token i continues the word of token i - 1
+            return offsets[i][0] == offsets[i - 1][1]
+
+        def sentence_end(i):
+            # A sentence ends after token i
+            return text[offsets[i][1] - 1] in SENTENCE_ENDINGS and not joined(i + 1)
+
+        chunks, start, total = [], 0, len(offsets)
+        while start < total:
+            end = min(start + self.max_tokens, total)
+            if end < total:
+                cut = end
+                if self.sentences:
+                    # Only go back half a window, tiny chunks embed poorly
+                    floor = start + self.max_tokens // 2
+                    for i in range(end - 1, floor - 1, -1):
+                        if sentence_end(i):
+                            cut = i + 1
+                            break
+                while cut > start + 1 and joined(cut):
+                    cut -= 1
+                end = cut if cut > start + 1 or not joined(cut) else end
+
+            chunks.append(
+                Chunk(
+                    text=text[offsets[start][0] : offsets[end - 1][1]],
+                    start=offsets[start][0],
+                    end=offsets[end - 1][1],
+                    token_count=end - start,
+                )
+            )
+            if end == total:
+                break
+            next_start = max(end - self.overlap, start + 1)
+            while next_start < end and joined(next_start):
+                next_start += 1
+            start = next_start
+        return chunks
@@ -0,0 +1,95 @@
+import hashlib
+
+import numpy as np
+from django.conf import settings
+from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
+
+from newsletter.utils.embedding_cache import normalize_text
+from newsletter.utils.model_registry import registry
+
+
+class EmbeddingBackend(Embeddings):
+    """
+    Embeddings used by ``PgvectorService``. ``model_id`` names the vector
+    space, two backends with the same id must return the same vectors.
+    """
+
+    name = None
+    model_id = None
+    dimensions = None
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Runs a sentence-transformers model in process, on ``EMBEDDING_DEVICE``."""
+
+    name = "local"
+
+    def __init__(self, model=None, batch_size=None):
+        self.model_id = model or settings.EMBEDDING_MODEL
+        self.batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+
+    @property
+    def dimensions(self):
+        return registry.get(self.model_id).get_sentence_embedding_dimension()
+
+    def embed_documents(self, texts):
+        return registry.encode(
+            list(texts), self.model_id, batch_size=self.batch_size
+        ).tolist()
+
+    def embed_query(self, text):
+        return registry.encode(text, self.model_id).tolist()
+
+
+class OpenAIBackend(EmbeddingBackend):
+    """OpenAI embeddings API, one remote call per batch of texts."""
+
+    name = "openai"
+
+    def __init__(self):
+        self.embeddings = OpenAIEmbeddings()
+        self.model_id = f"openai:{self.embeddings.model}"
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+class FakeBackend(EmbeddingBackend):
+    """
+    Deterministic unit vectors derived from a hash of the normalized text,
+    for running ingest and search without any model. Equal texts get equal
+    vectors, different texts unrelated ones.
+    """
+
+    name = "fake"
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+        self.model_id = f"fake:{dimensions}"
+
+    def _embed(self, text):
+        seed = hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+        rng = np.random.default_rng(int.from_bytes(seed[:8], "big"))
+        vector = rng.standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (SentenceTransformerBackend, OpenAIBackend, FakeBackend)
+}
+
+
+def get_embedding_backend(name=None):
+    """Return the embedding backend configured by ``EMBEDDING_BACKEND``."""
+    return BACKENDS[name or settings.EMBEDDING_BACKEND]()
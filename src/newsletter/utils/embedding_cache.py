@@ -0,0 +1,80 @@
+import hashlib
+import logging
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from newsletter.models import EmbeddingCache
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """Unicode NFC with collapsed whitespace, so trivial edits still hit."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCacheLookup:
+    """
+    Serves embeddings of ``model_id`` from the ``EmbeddingCache`` table and
+    only sends the texts it has never seen to the model.
+
+    ``hits`` and ``misses`` count the texts served from the cache and the
+    texts embedded, over the lifetime of the instance.
+    """
+
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, texts, encode):
+        """
+        :param texts: list of texts
+        :param encode: function embedding a list of texts, called once
+            with the texts missing from the cache
+        :return: list of embeddings, in the order of ``texts``
+        """
+        hashes = [text_hash(text) for text in texts]
+        found = EmbeddingCache.objects.lookup(self.model_id, set(hashes))
+
+        # Embed every missing text once, however often it repeats
+        missing = {}
+        for text, digest in zip(texts, hashes):
+            if digest not in found:
+                missing.setdefault(digest, text)
+        if missing:
+            vectors = encode(list(missing.values()))
+            computed = dict(zip(missing, (np.asarray(v) for v in vectors)))
+            EmbeddingCache.objects.store(self.model_id, computed)
+            found.update(computed)
+
+        misses = len(missing)
+        self.misses += misses
+        self.hits += len(texts) - misses
+        return [found[digest] for digest in hashes]
+
+    def __str__(self):
+        return f"{self.model_id}: {self.hits} hits, {self.misses} misses"
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain ``Embeddings`` wrapper checking the embedding cache first."""
+
+    def __init__(self, embeddings, model_id):
+        self.embeddings = embeddings
+        self.cache = EmbeddingCacheLookup(model_id)
+
+    def embed_documents(self, texts):
+        vectors = self.cache.encode(texts, self.embeddings.embed_documents)
+        logger.info("Embedding cache %s", self.cache)
+        return [np.asarray(vector).tolist() for vector in vectors]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,140 @@
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from newsletter.models import Paper, PaperChunks
+from newsletter.utils.chunking import TokenChunker
+from newsletter.utils.embedding_cache import EmbeddingCacheLookup
+from newsletter.utils.model_registry import registry
+from newsletter.utils.vector_index import get_vector_index
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_chunks(content, chunk_size=750):
+    """Naive chunking of a paper description, kept as the benchmark baseline.
+
+    `chunk_size` is the number of characters per chunk.
+    """
+    while content:
+        chunk, content = content[:chunk_size], content[chunk_size:]
+        yield chunk
+
+
+class EmbeddingEngine:
+    """
+    Embeds the chunks of many papers at once.
+
+    Papers are split by a ``TokenChunker`` into chunks that fit the model
+    window, tokenizing every paper once. The chunks of every paper are
+    gathered, sorted by length so each batch holds texts of similar length
+    and little padding, and encoded in ``batch_size`` batches. All
+    ``PaperChunks`` rows are then written with a single bulk insert.
+
+    Unless ``cache`` is off, chunks whose text was embedded before by the
+    same model are served from the embedding cache instead of the model.
+    Chunks are stamped with ``EMBEDDING_MODEL_VERSION`` so those of an older
+    model or chunking can be found and embedded again.
+    """
+
+    def __init__(self, name=None, batch_size=None, chunker=None, cache=None):
+        self.name = name or settings.EMBEDDING_MODEL
+        self.model_version = settings.EMBEDDING_MODEL_VERSION
+        self.batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        self.chunker = chunker or TokenChunker(self.name)
+        cache = settings.EMBEDDING_CACHE if cache is None else cache
+        self.cache = EmbeddingCacheLookup(self.name) if cache else None
+
+    def chunk(self, papers):
+        """:return: list of (paper, ``Chunk``) pairs"""
+        texts = [paper.title + "\n" + paper.abstract for paper in papers]
+        return [
+            (paper, chunk)
+            for paper, chunks in zip(papers, self.chunker.split_many(texts))
+            for chunk in chunks
+        ]
+
+    def encode(self, texts):
+        """:return: the embeddings of ``texts``, in their order"""
+        if self.cache is None:
+            return self._encode(texts)
+        return self.cache.encode(texts, self._encode)
+
+    def _encode(self, texts):
+        model = registry.get(self.name)
+        if not texts:
+            dimensions = model.get_sentence_embedding_dimension()
+            return np.empty((0, dimensions), dtype=np.float32)
+
+        # Longest first, so a batch too large for memory fails straight away
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        sorted_texts = [texts[i] for i in order]
+
+        embeddings = np.empty(
+            (len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32
+        )
+        for start in range(0, len(texts), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            embeddings[batch] = model.encode(
+                sorted_texts[start : start + self.batch_size],
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+            )
+
+        return embeddings
+
+    def embed(self, papers):
+        """:return: unsaved ``PaperChunks`` of every paper in ``papers``"""
+        chunks = self.chunk(papers)
+        embeddings = self.encode([chunk.text for _, chunk in chunks])
+        return [
+            PaperChunks(
+                paper=paper,
+                chunk=chunk.text,
+                token_count=chunk.token_count,
+                embedding=embedding,
+                embedding_half=embedding if settings.EMBEDDING_HALF_PRECISION else None,
+                model_version=self.model_version,
+            )
+            for (paper, chunk), embedding in zip(chunks, embeddings)
+        ]
+
+    def save(self, papers):
+        """
+        Embed ``papers`` and store their chunks in one bulk insert, in place
+        of any chunks they had.
+        """
+        paper_chunks = self.embed(papers)
+        paper_ids = [paper.pk for paper in papers]
+        PaperChunks.objects.replace(paper_ids, paper_chunks)
+        get_vector_index().replace(paper_ids, paper_chunks)
+        logger.info("Embedded %s chunks of %s papers", len(paper_chunks), len(papers))
+        if self.cache is not None:
+            logger.info("Embedding cache %s", self.cache)
+        return paper_chunks
+
+
+_engine = None
+
+
+def init_worker(threads=None):
+    """Process pool initializer, splitting the cores between the workers."""
+    if threads:
+        settings.EMBEDDING_THREADS = threads
+
+
+def embed_rows(rows):
+    """
+    Process pool task embedding ``rows`` of (paper id, title, abstract).
+
+    :return: unsaved ``PaperChunks`` of the papers
+    """
+    global _engine
+    if _engine is None:
+        # One engine per worker process, so the model loads once
+        _engine = EmbeddingEngine()
+    return _engine.embed(
+        [Paper(pk=pk, title=title, abstract=abstract) for pk, title, abstract in rows]
+    )
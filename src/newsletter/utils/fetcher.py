@@ -0,0 +1,194 @@
+import random
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+
+import aiohttp
+from django.conf import settings
+
+from newsletter.utils.http_cache import HttpCache
+from newsletter.utils.ratelimit import TokenBucket, retry_after_seconds
+from newsletter.utils.recordings import Recorder
+
+
+logger = logging.getLogger(__name__)
+
+
+user_agents = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:78.0) Gecko/20100101 Firefox/78.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:78.0) Gecko/20100101 Firefox/78.0",
+    "Mozilla/5.0 (X11; Linux i686; rv:78.0) Gecko/20100101 Firefox/78.0",
+    "Mozilla/5.0 (Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0",
+    "Mozilla/5.0 (X11; Ubuntu; Linux i686; rv:78.0) Gecko/20100101 Firefox/78.0",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0",
+    "Mozilla/5.0 (X11; Fedora; Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Trident/7.0; rv:11.0) like Gecko",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36 Edg/84.0.522.44",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36 Edg/84.0.522.44",
+]
+
+
+class FetchError(Exception):
+    """Raised when a page could not be fetched."""
+
+
+@dataclass
+class Page:
+    url: str
+    text: str
+    # True when the server answered 304 and ``text`` came from the cache
+    not_modified: bool = False
+    # Parsed result stored alongside the cached page, if any
+    parsed: object = None
+
+
+class ArxivFetcher:
+    """
+    Fetches many arxiv.org pages concurrently over one pooled HTTP session.
+
+    The connection pool caps the requests in flight to a single host at
+    ``per_host``. Connection errors, timeouts, 429 and 5xx responses are
+    retried with exponential backoff and jitter; any other error status
+    fails the page straight away.
+
+    Pages are revalidated against ``HttpCache`` with conditional GETs, so
+    an unchanged page costs a 304 instead of a full download.
+
+    Every request first takes a slot from the shared ``TokenBucket``. A 429
+    or 503 answer pauses the bucket for the Retry-After delay, holding back
+    every worker rather than letting each of them retry into the throttle.
+
+    When ``ARXIV_RECORD_DIR`` is set every page fetched is also saved there
+    as a fixture for ``ReplayServer``.
+    """
+
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, per_host=None, retries=None, backoff=None, timeout=None):
+        self.per_host = per_host or settings.ARXIV_FETCH_CONCURRENCY
+        self.retries = settings.ARXIV_FETCH_RETRIES if retries is None else retries
+        self.backoff = settings.ARXIV_FETCH_BACKOFF if backoff is None else backoff
+        self.timeout = timeout or settings.ARXIV_FETCH_TIMEOUT
+        self.http_cache = HttpCache()
+        self.limiter = TokenBucket()
+        self.recorder = (
+            Recorder(settings.ARXIV_RECORD_DIR) if settings.ARXIV_RECORD_DIR else None
+        )
+
+    def _session(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def _get(self, session, url):
+        entry = await self.http_cache.aget(url)
+        headers = {
+            "User-Agent": random.choice(user_agents),
+            **self.http_cache.conditional_headers(entry),
+        }
+        await self.limiter.aacquire()
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and entry is not None:
+                page = Page(url, entry["body"], True, entry.get("parsed"))
+                self._record(page)
+                return page
+            if response.status in (429, 503):
+                await self.limiter.apenalize(
+                    retry_after_seconds(
+                        response.headers.get("Retry-After"), self.backoff
+                    )
+                )
+            if response.status in self.retry_statuses:
+                raise aiohttp.ClientResponseError(
+                    response.request_info,
+                    response.history,
+                    status=response.status,
+                    message=response.reason,
+                )
+            if response.status >= 400:
+                raise FetchError(f"{url} returned HTTP {response.status}")
+            text = await response.text()
+        entry = self.http_cache.make_entry(text, response.headers)
+        await self.http_cache.aset(url, entry)
+        page = Page(url, text)
+        self._record(page)
+        return page
+
+    def _record(self, page):
+        if self.recorder is not None:
+            self.recorder.save(page.url, page.text)
+
+    async def fetch(self, session, url):
+        """Fetch a single page, retrying transient failures."""
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._get(session, url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise FetchError(f"Could not fetch {url}: {e}") from e
+                delay = self.backoff * 2**attempt + random.uniform(0, self.backoff)
+                logger.warning(
+                    "Fetching %s failed (%s), retrying in %.1fs", url, e, delay
+                )
+                await asyncio.sleep(delay)
+
+    async def _open(self):
+        return self._session()
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def __enter__(self):
+        # Serve blocking ``get`` calls from an event loop on its own thread
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._client = self._submit(self._open()).result()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._submit(self._client.close()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def get(self, url):
+        """
+        Fetch ``url`` over the shared session, blocking the calling thread.
+        Only usable inside a ``with ArxivFetcher() as fetcher:`` block.
+        """
+        return self._submit(self.fetch(self._client, url)).result()
+
+    async def fetch_all(self, urls):
+        """
+        Fetch all ``urls`` concurrently.
+
+        :param urls: list of page urls
+        :return: dict mapping each url to its ``Page``, or to the
+            ``FetchError`` raised for it
+        """
+        async with self._session() as session:
+            pages = await asyncio.gather(
+                *(self.fetch(session, url) for url in urls), return_exceptions=True
+            )
+        return dict(zip(urls, pages))
+
+
+def fetch_pages(urls, **kwargs):
+    """Blocking helper around ``ArxivFetcher.fetch_all``."""
+    return asyncio.run(ArxivFetcher(**kwargs).fetch_all(list(urls)))
+
+
+def fetch_page(url, **kwargs):
+    """Fetch a single page, raising ``FetchError`` on failure."""
+    page = fetch_pages([url], **kwargs)[url]
+    if isinstance(page, Exception):
+        raise page
+    return page
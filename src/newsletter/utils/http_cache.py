@@ -0,0 +1,63 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class HttpCache:
+    """
+    Stores arxiv.org pages keyed by url along with their ETag and
+    Last-Modified validators, so a repeated fetch can be sent as a
+    conditional GET and answered with a bodyless 304.
+
+    An entry may also carry the ``parsed`` result of the page so callers
+    can skip parsing a page the server reported as unchanged.
+    """
+
+    key_prefix = "arxiv-http"
+
+    def __init__(self, alias=None, timeout=None):
+        self.cache = caches[alias or settings.ARXIV_HTTP_CACHE]
+        self.timeout = timeout or settings.ARXIV_HTTP_CACHE_TIMEOUT
+
+    def key(self, url):
+        # Hash the url to stay within the key length limits of every backend
+        return f"{self.key_prefix}:{hashlib.sha256(url.encode()).hexdigest()}"
+
+    @staticmethod
+    def make_entry(body, headers):
+        return {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "body": body,
+            "parsed": None,
+        }
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Request headers that revalidate a cached ``entry``."""
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def get(self, url):
+        return self.cache.get(self.key(url))
+
+    def set(self, url, entry):
+        self.cache.set(self.key(url), entry, self.timeout)
+
+    async def aget(self, url):
+        return await self.cache.aget(self.key(url))
+
+    async def aset(self, url, entry):
+        await self.cache.aset(self.key(url), entry, self.timeout)
+
+    def set_parsed(self, url, parsed):
+        """Attach the parsed result of ``url`` to its cached entry."""
+        entry = self.get(url)
+        if entry is not None:
+            entry["parsed"] = parsed
+            self.set(url, entry)
@@ -0,0 +1,110 @@
+import time
+import logging
+import threading
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Loads each sentence-transformers model once per process and hands the
+    same instance to every caller.
+
+    Loading is guarded by a lock per model name, so concurrent first calls
+    from several threads trigger a single load. The tokenizer is the one
+    bundled with the model, no separate ``AutoTokenizer`` is loaded.
+
+    ``EMBEDDING_RUNTIME`` picks how models run: "torch" loads a
+    ``SentenceTransformer``, "onnx" an ``OnnxEncoder`` over the export
+    written by the ``export_onnx`` command. Each runtime is only imported
+    when used, so ONNX workers do not need torch installed.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name=None):
+        """Return the loaded model ``name``, loading it on first use."""
+        name = name or settings.EMBEDDING_MODEL
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._name_lock(name):
+            # Another thread may have loaded it while we waited
+            model = self._models.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = self._load(name)
+                self._models[name] = model
+                logger.info(
+                    "Loaded model %s in %.2fs", name, time.perf_counter() - start
+                )
+        return model
+
+    def _load(self, name):
+        if settings.EMBEDDING_RUNTIME == "onnx":
+            from newsletter.utils.onnx_encoder import OnnxEncoder, onnx_model_dir
+
+            return OnnxEncoder(
+                onnx_model_dir(name), quantized=settings.EMBEDDING_ONNX_QUANTIZED
+            )
+
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if settings.EMBEDDING_THREADS:
+            torch.set_num_threads(settings.EMBEDDING_THREADS)
+        return SentenceTransformer(name, device=settings.EMBEDDING_DEVICE)
+
+    def encode(self, texts, name=None, **kwargs):
+        """
+        Embed ``texts`` with model ``name``.
+
+        :param texts: a string or a list of strings
+        :param kwargs: passed on to the ``encode`` method of the model
+        :return: a vector for a string, an array of vectors for a list
+        """
+        return self.get(name).encode(texts, **kwargs)
+
+    def tokenize(self, text, name=None):
+        """Split ``text`` into the tokens seen by model ``name``."""
+        name = name or settings.EMBEDDING_MODEL
+        tokenizer = self.get(name).tokenizer
+        # Fast tokenizers refuse concurrent use of one instance
+        with self._name_lock(name):
+            return tokenizer.tokenize(text)
+
+    def batch_tokenize(self, texts, name=None, **kwargs):
+        """
+        Tokenize all ``texts`` in one call, without special tokens.
+
+        :param kwargs: passed on to the tokenizer, e.g.
+            ``return_offsets_mapping=True``
+        """
+        name = name or settings.EMBEDDING_MODEL
+        tokenizer = self.get(name).tokenizer
+        with self._name_lock(name):
+            return tokenizer(texts, add_special_tokens=False, **kwargs)
+
+    def warm_up(self, names=None):
+        """Load ``names``, by default ``EMBEDDING_WARM_UP_MODELS``, up front."""
+        for name in settings.EMBEDDING_WARM_UP_MODELS if names is None else names:
+            # Run one inference too, so lazy initialisation is paid here
+            self.encode("warm up", name)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+registry = ModelRegistry()
@@ -0,0 +1,159 @@
+import io
+import os
+import json
+import random
+import logging
+import xml.etree.ElementTree as ET
+
+import requests
+from django.conf import settings
+
+from newsletter.utils.fetcher import user_agents
+from newsletter.utils.parsers import make_paper
+from newsletter.utils.ratelimit import TokenBucket, retry_after_seconds
+
+
+logger = logging.getLogger(__name__)
+
+
+OAI_NS = "{http://www.openarchives.org/OAI/2.0/}"
+ARXIV_NS = "{http://arxiv.org/OAI/arXiv/}"
+
+
+class HarvestError(Exception):
+    """Raised when the OAI-PMH endpoint answers with an error."""
+
+
+def _text(element, path):
+    found = element.find(path)
+    return " ".join(found.text.split()) if found is not None and found.text else ""
+
+
+def _record_to_paper(metadata):
+    authors = []
+    for author in metadata.iter(f"{ARXIV_NS}author"):
+        name = " ".join(
+            part
+            for part in (
+                _text(author, f"{ARXIV_NS}forenames"),
+                _text(author, f"{ARXIV_NS}keyname"),
+                _text(author, f"{ARXIV_NS}suffix"),
+            )
+            if part
+        )
+        authors.append(name)
+
+    categories = _text(metadata, f"{ARXIV_NS}categories").split()
+    paper = make_paper(
+        _text(metadata, f"{ARXIV_NS}id"),
+        _text(metadata, f"{ARXIV_NS}title"),
+        ", ".join(authors),
+        "; ".join(categories),
+        _text(metadata, f"{ARXIV_NS}abstract"),
+    )
+    paper["categories"] = categories
+    return paper
+
+
+class OAIHarvester:
+    """
+    Pages through arXiv's OAI-PMH ``ListRecords`` feed in the ``arXiv``
+    metadata format.
+
+    Progress is checkpointed to a JSON file holding the resumption token of
+    the next page. The checkpoint is only advanced once the caller asks for
+    the next page, i.e. after it has processed the previous one, so an
+    interrupted harvest resumes from the first unprocessed page.
+    """
+
+    def __init__(self, checkpoint_path, base_url=None, retries=None):
+        self.checkpoint_path = checkpoint_path
+        self.base_url = base_url or settings.ARXIV_OAI_URL
+        self.retries = settings.ARXIV_FETCH_RETRIES if retries is None else retries
+        self.session = requests.Session()
+        self.limiter = TokenBucket()
+
+    def _load_checkpoint(self, params):
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, "r") as file:
+            checkpoint = json.load(file)
+        # A checkpoint of a different harvest is ignored
+        return checkpoint if checkpoint["params"] == params else None
+
+    def _save_checkpoint(self, params, token, harvested):
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(f"{self.checkpoint_path}.tmp", "w") as file:
+            json.dump({"params": params, "token": token, "harvested": harvested}, file)
+        os.replace(f"{self.checkpoint_path}.tmp", self.checkpoint_path)
+
+    def _request(self, params):
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            response = self.session.get(
+                self.base_url,
+                params=params,
+                headers={"User-Agent": random.choice(user_agents)},
+                timeout=settings.ARXIV_FETCH_TIMEOUT,
+            )
+            # arXiv throttles harvesters with 503 + Retry-After
+            if response.status_code != 503 or attempt == self.retries:
+                response.raise_for_status()
+                return response.content
+            delay = retry_after_seconds(response.headers.get("Retry-After"), 2**attempt)
+            logger.info("OAI-PMH endpoint asked to retry in %ss", delay)
+            # The next acquire() waits out the delay
+            self.limiter.penalize(delay)
+
+    def _parse(self, content):
+        papers, token = [], None
+        for _, element in ET.iterparse(io.BytesIO(content)):
+            if element.tag == f"{OAI_NS}error":
+                if element.get("code") == "noRecordsMatch":
+                    continue
+                raise HarvestError(f"{element.get('code')}: {element.text}")
+            if element.tag == f"{OAI_NS}record":
+                metadata = element.find(f"{OAI_NS}metadata/{ARXIV_NS}arXiv")
+                if metadata is not None:
+                    papers.append(_record_to_paper(metadata))
+                element.clear()
+            elif element.tag == f"{OAI_NS}resumptionToken":
+                token = element.text or None
+        return papers, token
+
+    def pages(self, from_date, until=None, set_spec=None):
+        """
+        Yield lists of paper dicts, one list per ``ListRecords`` page.
+
+        :param from_date: first datestamp to harvest (YYYY-MM-DD)
+        :param until: last datestamp to harvest, defaults to today
+        :param set_spec: OAI set such as ``cs`` or ``physics:hep-th``
+        """
+        params = {"from": from_date, "until": until, "set": set_spec}
+        checkpoint = self._load_checkpoint(params)
+        token = checkpoint["token"] if checkpoint else None
+        harvested = checkpoint["harvested"] if checkpoint else 0
+        if checkpoint and token is None:
+            logger.info("Harvest %s already completed", params)
+            return
+
+        while True:
+            if token:
+                query = {"verb": "ListRecords", "resumptionToken": token}
+            else:
+                query = {
+                    "verb": "ListRecords",
+                    "metadataPrefix": "arXiv",
+                    **{key: value for key, value in params.items() if value},
+                }
+            papers, token = self._parse(self._request(query))
+
+            yield papers
+
+            harvested += len(papers)
+            self._save_checkpoint(params, token, harvested)
+            logger.info("Harvested %s records", harvested)
+            if token is None:
+                return
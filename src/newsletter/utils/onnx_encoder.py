@@ -0,0 +1,175 @@
+import os
+import json
+import logging
+import threading
+
+import numpy as np
+import onnxruntime
+from django.conf import settings
+from django.utils.text import slugify
+from transformers import AutoTokenizer
+
+
+logger = logging.getLogger(__name__)
+
+
+CONFIG_FILE = "encoder.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+
+def onnx_model_dir(name):
+    """Directory holding the ONNX export of model ``name``."""
+    return os.path.join(settings.EMBEDDING_ONNX_DIR, slugify(name.replace("/", "-")))
+
+
+def export_onnx(model, directory, quantize=True):
+    """
+    Export the transformer of a ``SentenceTransformer`` to ONNX, along with
+    its tokenizer and the pooling settings ``OnnxEncoder`` needs.
+
+    :param quantize: also write a copy with dynamically int8-quantized weights
+    """
+    # Only the export needs torch, and the quantization the onnx package
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    class Transformer(torch.nn.Module):
+        # Takes the inputs by name and returns the token embeddings only
+        def __init__(self, transformer, input_names):
+            super().__init__()
+            self.transformer = transformer
+            self.input_names = input_names
+
+        def forward(self, *inputs):
+            outputs = self.transformer(**dict(zip(self.input_names, inputs)))
+            return outputs.last_hidden_state
+
+    os.makedirs(directory, exist_ok=True)
+    model.tokenizer.save_pretrained(directory)
+
+    inputs = model.tokenizer(["export"], return_tensors="pt")
+    input_names = [
+        name
+        for name in ("input_ids", "attention_mask", "token_type_ids")
+        if name in inputs
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    transformer = Transformer(model[0].auto_model, input_names).eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(inputs[name] for name in input_names),
+            os.path.join(directory, MODEL_FILE),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+
+    pooling = model[1].get_config_dict()
+    # Older sentence-transformers releases spell the mode as flags
+    mode = pooling.get("pooling_mode") or (
+        "mean" if pooling.get("pooling_mode_mean_tokens") else "cls"
+    )
+    if mode not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode {mode}")
+    with open(os.path.join(directory, CONFIG_FILE), "w") as file:
+        json.dump(
+            {
+                "max_seq_length": model.max_seq_length,
+                "dimensions": model.get_sentence_embedding_dimension(),
+                "pooling": mode,
+                # sentence-transformers appends a Normalize module when needed
+                "normalize": any(
+                    type(module).__name__ == "Normalize" for module in model
+                ),
+            },
+            file,
+        )
+
+    if quantize:
+        quantize_dynamic(
+            os.path.join(directory, MODEL_FILE),
+            os.path.join(directory, QUANTIZED_MODEL_FILE),
+            weight_type=QuantType.QInt8,
+        )
+
+
+class OnnxEncoder:
+    """
+    Runs a sentence-transformers model exported by ``export_onnx`` with
+    onnxruntime on the CPU, pooling and normalizing in NumPy.
+
+    It exposes the parts of ``SentenceTransformer`` the embedding code uses
+    (``encode``, ``tokenizer``, ``max_seq_length`` and
+    ``get_sentence_embedding_dimension``), and does not need torch.
+    """
+
+    def __init__(self, directory, quantized=True):
+        with open(os.path.join(directory, CONFIG_FILE), "r") as file:
+            self.config = json.load(file)
+        self.max_seq_length = self.config["max_seq_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        self._tokenizer_lock = threading.Lock()
+
+        path = os.path.join(directory, QUANTIZED_MODEL_FILE)
+        if not quantized or not os.path.exists(path):
+            path = os.path.join(directory, MODEL_FILE)
+        options = onnxruntime.SessionOptions()
+        if settings.EMBEDDING_THREADS:
+            options.intra_op_num_threads = settings.EMBEDDING_THREADS
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {input.name for input in self.session.get_inputs()}
+        logger.info("Loaded ONNX model %s", path)
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimensions"]
+
+    def _encode_batch(self, texts):
+        with self._tokenizer_lock:
+            inputs = self.tokenizer(
+                texts,
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+        feed = {
+            name: array.astype(np.int64)
+            for name, array in inputs.items()
+            if name in self.input_names
+        }
+        (hidden,) = self.session.run(["last_hidden_state"], feed)
+
+        if self.config["pooling"] == "mean":
+            mask = inputs["attention_mask"][..., np.newaxis].astype(np.float32)
+            embeddings = (hidden * mask).sum(axis=1) / np.clip(
+                mask.sum(axis=1), 1e-9, None
+            )
+        else:
+            embeddings = hidden[:, 0]
+        if self.config["normalize"]:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings.astype(np.float32)
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        """
+        Embed a string or a list of strings, like ``SentenceTransformer.encode``.
+        Batches are formed from texts of similar length to limit padding.
+        """
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        embeddings = np.empty(
+            (len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32
+        )
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start : start + batch_size]
+            embeddings[batch] = self._encode_batch([texts[i] for i in batch])
+        return embeddings[0] if single else embeddings
@@ -0,0 +1,172 @@
+from io import BytesIO
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover
+    etree = None
+
+
+ARXIV_ABS_URL = "https://arxiv.org/abs/"
+
+
+def make_paper(paper_number, title, authors, subjects, abstract):
+    """Build the paper dict stored in the daily listing snapshots."""
+    return {
+        "main_page": ARXIV_ABS_URL + paper_number,
+        "pdf": ARXIV_ABS_URL.replace("abs", "pdf") + paper_number,
+        "tex_source": ARXIV_ABS_URL.replace("abs", "src") + paper_number,
+        "title": title.replace("Title: ", "").strip(),
+        "authors": authors.replace("Authors:\n", "").replace("\n", "").strip(),
+        "subjects": subjects.replace("Subjects: ", "").strip(),
+        "abstract": abstract.replace("\n", " ").strip(),
+        "paper_number": paper_number,
+        "google_scholar": (
+            f"https://scholar.google.com/scholar_lookup?arxiv_id={paper_number}"
+        ),
+        "semantic_scholar": f"https://api.semanticscholar.org/arXiv:{paper_number}",
+    }
+
+
+def _paper_number(dt_text):
+    # e.g: "[1]  arXiv:2305.05007 [pdf, other]"
+    return dt_text.strip().split(" ")[2].split(":")[-1]
+
+
+class ListingParser:
+    """
+    Reads an arxiv.org ``/list/<abbrv>/new`` page and returns the new
+    submissions as a list of paper dicts (see ``make_paper``).
+    """
+
+    name = None
+
+    def parse(self, page):
+        raise NotImplementedError
+
+
+class SoupListingParser(ListingParser):
+    """Builds the whole page tree with BeautifulSoup's ``html.parser``."""
+
+    name = "soup"
+
+    def parse(self, page):
+        soup = BeautifulSoup(page, "html.parser")
+        content = soup.body.find("div", {"id": "content"})
+
+        dt_list = content.dl.find_all("dt")
+        dd_list = content.dl.find_all("dd")
+
+        assert len(dt_list) == len(dd_list)
+        new_paper_list = []
+        for dt, dd in zip(dt_list, dd_list):
+            new_paper_list.append(
+                make_paper(
+                    _paper_number(dt.text),
+                    dd.find("div", {"class": "list-title mathjax"}).text,
+                    dd.find("div", {"class": "list-authors"}).text,
+                    dd.find("div", {"class": "list-subjects"}).text,
+                    dd.find("p", {"class": "mathjax"}).text,
+                )
+            )
+        return new_paper_list
+
+
+class LxmlListingParser(ListingParser):
+    """
+    Streams the page through lxml's ``iterparse``, handling each ``dt``/``dd``
+    pair as soon as it is closed and discarding it afterwards, so only one
+    entry is ever held in memory. Parsing stops at the end of the first
+    listing in ``div#content``.
+    """
+
+    name = "lxml"
+
+    @staticmethod
+    def _text(element):
+        return etree.tostring(
+            element, method="text", encoding="unicode", with_tail=False
+        )
+
+    @staticmethod
+    def _has_class(element, name):
+        return name in element.get("class", "").split()
+
+    @staticmethod
+    def _discard(element):
+        element.clear(keep_tail=True)
+        parent = element.getparent()
+        while parent is not None and element.getprevious() is not None:
+            del parent[0]
+
+    def _fields(self, dd):
+        fields = {}
+        for element in dd.iter("div", "p"):
+            if element.tag == "div":
+                for name in ("list-title", "list-authors", "list-subjects"):
+                    if name not in fields and self._has_class(element, name):
+                        fields[name] = self._text(element)
+            elif "abstract" not in fields and self._has_class(element, "mathjax"):
+                fields["abstract"] = self._text(element)
+        return fields
+
+    def parse(self, page):
+        if isinstance(page, str):
+            page = page.encode("utf-8")
+
+        events = etree.iterparse(
+            BytesIO(page),
+            events=("start", "end"),
+            tag=("div", "dl", "dt", "dd"),
+            html=True,
+            encoding="utf-8",
+        )
+
+        in_content = False
+        in_listing = False
+        paper_number = None
+        new_paper_list = []
+        for event, element in events:
+            if event == "start":
+                if element.tag == "div" and element.get("id") == "content":
+                    in_content = True
+                elif element.tag == "dl" and in_content:
+                    in_listing = True
+                continue
+
+            if not in_listing:
+                continue
+            if element.tag == "dl":
+                break
+            if element.tag == "dt":
+                paper_number = _paper_number(self._text(element))
+                self._discard(element)
+            elif element.tag == "dd":
+                fields = self._fields(element)
+                new_paper_list.append(
+                    make_paper(
+                        paper_number,
+                        fields["list-title"],
+                        fields["list-authors"],
+                        fields["list-subjects"],
+                        fields["abstract"],
+                    )
+                )
+                self._discard(element)
+        return new_paper_list
+
+
+PARSERS = {parser.name: parser for parser in (SoupListingParser, LxmlListingParser)}
+
+
+def get_listing_parser(name=None):
+    """
+    Return the listing parser configured by ``ARXIV_LISTING_PARSER``,
+    falling back to BeautifulSoup when lxml is not installed.
+    """
+    name = name or settings.ARXIV_LISTING_PARSER
+    if name == LxmlListingParser.name and etree is None:
+        name = SoupListingParser.name
+    return PARSERS[name]()
@@ -1,33 +1,88 @@
-from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain_community.vectorstores.pgvector import (
     PGVector,
     _get_embedding_collection_store,
 )
 from langchain_core.documents import Document
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, delete, func, select, text
 from sqlalchemy.orm import Session
+from django.conf import settings
+
+from newsletter.utils.embedding_backends import get_embedding_backend
+from newsletter.utils.embedding_cache import CachedEmbeddings
 
 # from dotenv import load_dotenv
+import os
+import hashlib
 import logging
+import threading
+
+
+EmbeddingStore, CollectionStore = _get_embedding_collection_store()
+
+_engines = {}
+_engines_lock = threading.Lock()
 
 
-EmbeddingStore = _get_embedding_collection_store()[0]
+def get_engine(connection_string):
+    """
+    Return the SQLAlchemy engine of ``connection_string`` for this process,
+    creating it on first use. Its connection pool is shared by every
+    ``PgvectorService``; forked processes get their own.
+    """
+    key = (os.getpid(), connection_string)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = create_engine(connection_string, pool_pre_ping=True)
+        return _engines[key]
+
+
+def document_hash(text):
+    """md5 of a document, as computed by Postgres' ``md5()``."""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
 
 
 class PgvectorService:
-    def __init__(self, connection_string):
+    """
+    LangChain PGVector collections of paper documents.
+
+    Documents and queries are embedded by ``backend``, by default the one
+    named by ``EMBEDDING_BACKEND``. The "local" backend shares its model
+    and vector space with ``PaperChunks.embedding``.
+
+    Collections record the ``model_id`` of the backend that filled them,
+    and only collections of the service's backend are searched or written.
+    """
+
+    def __init__(self, connection_string, backend=None):
         # load_dotenv()
-        self.embeddings = OpenAIEmbeddings()
+        self.backend = backend or get_embedding_backend()
+        self.embeddings = self.backend
+        if settings.EMBEDDING_CACHE:
+            # Re-ingested papers are not embedded again
+            self.embeddings = CachedEmbeddings(self.backend, self.backend.model_id)
         self.cnx = connection_string
         self.collections = []
-        self.engine = create_engine(self.cnx)
+        self.engine = get_engine(self.cnx)
         self.EmbeddingStore = EmbeddingStore
+        self.collection_metadata = {"model_id": self.backend.model_id}
 
     def get_vector(self, text):
         return self.embeddings.embed_query(text)
 
-    def custom_similarity_search_with_scores(self, query, k=10):
+    def custom_similarity_search_with_scores(self, query, k=10, collection_name=None):
+        """
+        Search the collections embedded by the service's backend, vectors of
+        other models do not share its space or even its dimensions.
+
+        :param collection_name: search this collection only
+        """
         query_vector = self.get_vector(query)
+        collections = select(CollectionStore.uuid).where(
+            CollectionStore.cmetadata["model_id"].as_string()
+            == self.backend.model_id
+        )
+        if collection_name is not None:
+            collections = collections.where(CollectionStore.name == collection_name)
 
         with Session(self.engine) as session:
             # Using cosine similarity for the vector comparison
@@ -42,6 +97,7 @@ class PgvectorService:
                     self.EmbeddingStore.custom_id,
                     cosine_distance,
                 )
+                .filter(self.EmbeddingStore.collection_id.in_(collections))
                 .order_by(cosine_distance.asc())
                 .limit(k)
                 .all()
@@ -63,11 +119,85 @@ class PgvectorService:
                 embedding=self.embeddings,
                 documents=docs,
                 collection_name=collection_name,
+                collection_metadata=self.collection_metadata,
                 connection_string=self.cnx,
                 connection=connection,
                 pre_delete_collection=overwrite,
             )
 
+    def upsert_documents(self, docs, collection_name, ids):
+        """
+        Write ``docs`` into a collection, creating it if needed, keyed by
+        ``ids`` (stored as ``custom_id``). Only documents that are new, or
+        whose text or metadata changed, are embedded and written; changed
+        ones replace their previous row.
+
+        :param ids: one id per document, the last document of a repeated id wins
+        :return: the number of added, updated and unchanged documents
+        :raises ValueError: when the collection holds another model's embeddings
+        """
+        docs = dict(zip((str(id) for id in ids), docs))
+        # Creates the tables and the collection when they do not exist yet
+        store = PGVector(
+            collection_name=collection_name,
+            collection_metadata=self.collection_metadata,
+            connection_string=self.cnx,
+            connection=self.engine,
+            embedding_function=self.embeddings,
+        )
+
+        with Session(self.engine) as session:
+            collection = store.get_collection(session)
+            model_id = (collection.cmetadata or {}).get("model_id")
+            if model_id != self.backend.model_id:
+                raise ValueError(
+                    f"Collection {collection_name} holds {model_id or 'untagged'} "
+                    f"embeddings, not {self.backend.model_id}; delete it to re-embed"
+                )
+            rows = session.execute(
+                select(
+                    self.EmbeddingStore.custom_id,
+                    func.md5(self.EmbeddingStore.document),
+                    self.EmbeddingStore.cmetadata,
+                ).where(
+                    self.EmbeddingStore.collection_id == collection.uuid,
+                    self.EmbeddingStore.custom_id.in_(list(docs)),
+                )
+            )
+            stored = {custom_id: (md5, metadata) for custom_id, md5, metadata in rows}
+            changed = [
+                custom_id
+                for custom_id, doc in docs.items()
+                if stored.get(custom_id)
+                != (document_hash(doc.page_content), doc.metadata)
+            ]
+
+            if changed:
+                texts = [docs[custom_id].page_content for custom_id in changed]
+                embeddings = self.embeddings.embed_documents(texts)
+                session.execute(
+                    delete(self.EmbeddingStore).where(
+                        self.EmbeddingStore.collection_id == collection.uuid,
+                        self.EmbeddingStore.custom_id.in_(changed),
+                    )
+                )
+                session.bulk_save_objects(
+                    [
+                        self.EmbeddingStore(
+                            collection_id=collection.uuid,
+                            custom_id=custom_id,
+                            document=text,
+                            cmetadata=docs[custom_id].metadata,
+                            embedding=embedding,
+                        )
+                        for custom_id, text, embedding in zip(changed, texts, embeddings)
+                    ]
+                )
+                session.commit()
+
+        updated = sum(custom_id in stored for custom_id in changed)
+        return len(changed) - updated, updated, len(docs) - len(changed)
+
     def get_collections(self) -> list:
         with self.engine.connect() as connection:
             try:
@@ -79,14 +209,23 @@ class PgvectorService:
                 collections = []
         return collections
 
-    def update_collection(self, docs, collection_name):
-        """Updates a collection with data from a given blob URL."""
+    def update_collection(self, docs, collection_name, ids=None):
+        """
+        Upserts documents into a collection, by default keyed by the ``id``
+        of their metadata. Documents already stored unchanged are skipped.
+        """
         logging.info(f"Updating collection: {collection_name}")
-        collections = self.get_collections()
 
         if docs is not None:
-            overwrite = collection_name in collections
-            self.update_pgvector_collection(docs, collection_name, overwrite)
+            if ids is None:
+                ids = [doc.metadata["id"] for doc in docs]
+            added, updated, unchanged = self.upsert_documents(
+                docs, collection_name, ids
+            )
+            logging.info(
+                f"Collection {collection_name}: {added} added, {updated} updated, "
+                f"{unchanged} unchanged"
+            )
 
     def delete_collection(self, collection_name):
         """Deletes a collection based on the collection name."""
@@ -0,0 +1,142 @@
+import time
+import queue
+import reprlib
+import logging
+import threading
+
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        # list of (short item repr, exception) pairs
+        self.errors = []
+        # total time spent inside the stage function, across workers
+        self.busy = 0.0
+        # time between the first worker starting and the last one finishing
+        self.wall = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, item=None, error=None):
+        with self._lock:
+            self.busy += elapsed
+            if error is None:
+                self.processed += 1
+            else:
+                self.failed += 1
+                self.errors.append((reprlib.repr(item), error))
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.processed} ok, {self.failed} failed, "
+            f"{self.workers} worker(s), {self.busy:.2f}s busy, {self.wall:.2f}s wall"
+        )
+
+
+class Stage:
+    """
+    A pipeline step running ``func`` on ``workers`` threads.
+
+    ``func`` takes one item and returns the item handed to the next stage,
+    or None to drop it. An exception fails that item only: it is recorded
+    in the stage stats and the workers carry on.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages joined by bounded queues.
+
+    A full queue blocks the stage feeding it, so a slow stage throttles
+    the ones before it instead of letting work pile up in memory. Worker
+    threads close their database connection when they exit, so the number
+    of open connections is capped by the worker counts.
+    """
+
+    def __init__(self, stages, maxsize=8):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.stats = [StageStats(stage.name, stage.workers) for stage in stages]
+
+    def _work(self, stage, stats, inbox, outbox, results):
+        try:
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    return
+
+                start = time.perf_counter()
+                try:
+                    output = stage.func(item)
+                except Exception as e:
+                    stats.record(time.perf_counter() - start, item, e)
+                    logger.exception(
+                        "Stage %s failed on %s", stage.name, reprlib.repr(item)
+                    )
+                    continue
+                stats.record(time.perf_counter() - start)
+
+                if output is None:
+                    continue
+                if outbox is not None:
+                    outbox.put(output)
+                else:
+                    results.append(output)
+        finally:
+            connection.close()
+
+    def run(self, items):
+        """
+        Feed ``items`` through every stage.
+
+        :return: list of the outputs of the last stage
+        """
+        queues = [queue.Queue(self.maxsize) for _ in self.stages]
+        results = []
+
+        workers = []
+        for i, (stage, stats) in enumerate(zip(self.stages, self.stats)):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            threads = [
+                threading.Thread(
+                    target=self._work,
+                    args=(stage, stats, queues[i], outbox, results),
+                    name=f"{stage.name}-{n}",
+                )
+                for n in range(stage.workers)
+            ]
+            for thread in threads:
+                thread.start()
+            workers.append(threads)
+
+        start = time.perf_counter()
+        for item in items:
+            queues[0].put(item)
+
+        # Close the stages in order: a stage is only told to stop once every
+        # worker of the stage feeding it has exited
+        for inbox, threads, stats in zip(queues, workers, self.stats):
+            for _ in threads:
+                inbox.put(_DONE)
+            for thread in threads:
+                thread.join()
+            stats.wall = time.perf_counter() - start
+
+        for stats in self.stats:
+            logger.info(str(stats))
+        return results
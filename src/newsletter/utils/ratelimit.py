@@ -0,0 +1,131 @@
+import time
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(value, default):
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class LocalTokenBucket:
+    """
+    In-process token bucket, refilled at ``rate`` tokens per second and
+    holding at most ``burst`` tokens.
+
+    It is implemented as a GCRA scheduler: the state is the theoretical
+    arrival time (``tat``) of the next request, and ``reserve`` books the
+    next free slot instead of refusing the caller.
+    """
+
+    def __init__(self, rate, burst):
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _schedule(self, tat, blocked_until, now):
+        tat = max(tat, blocked_until, now)
+        allowed_at = max(now, tat - self.tolerance, blocked_until)
+        return tat + self.interval, allowed_at - now
+
+    def reserve(self):
+        """Book a request slot; returns the seconds to wait before using it."""
+        with self.lock:
+            self.tat, wait = self._schedule(self.tat, self.blocked_until, time.time())
+        return wait
+
+    def penalize(self, seconds):
+        """Hold every request back for ``seconds``."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+
+class TokenBucket(LocalTokenBucket):
+    """
+    Token bucket shared by every process through the Django cache, so all
+    Celery workers together stay under one request rate.
+
+    A cache lock makes the read-modify-write of the bucket state atomic.
+    When the cache cannot be reached the bucket falls back to its
+    in-process state.
+    """
+
+    lock_timeout = 5
+
+    def __init__(self, name=None, rate=None, burst=None, alias=None):
+        super().__init__(
+            rate or settings.ARXIV_RATE_LIMIT, burst or settings.ARXIV_RATE_BURST
+        )
+        self.name = name or "arxiv"
+        self.cache = caches[alias or settings.ARXIV_RATE_LIMIT_CACHE]
+        self.key = f"ratelimit:{self.name}"
+
+    def _locked(self, update):
+        lock_key = f"{self.key}:lock"
+        deadline = time.time() + self.lock_timeout
+        while not self.cache.add(lock_key, 1, self.lock_timeout):
+            if time.time() > deadline:
+                raise TimeoutError(f"Could not lock rate limiter {self.name}")
+            time.sleep(0.005)
+        try:
+            state = self.cache.get(self.key) or {"tat": 0.0, "blocked_until": 0.0}
+            state, result = update(state)
+            self.cache.set(self.key, state, None)
+            return result
+        finally:
+            self.cache.delete(lock_key)
+
+    def reserve(self):
+        def update(state):
+            tat, wait = self._schedule(
+                state["tat"], state["blocked_until"], time.time()
+            )
+            return {**state, "tat": tat}, wait
+
+        try:
+            return self._locked(update)
+        except Exception as e:
+            logger.warning("Shared rate limiter unavailable (%s), using local", e)
+            return super().reserve()
+
+    def penalize(self, seconds):
+        def update(state):
+            blocked_until = max(state["blocked_until"], time.time() + seconds)
+            return {**state, "blocked_until": blocked_until}, None
+
+        logger.info("Rate limiter %s backing off for %.1fs", self.name, seconds)
+        super().penalize(seconds)
+        try:
+            self._locked(update)
+        except Exception as e:
+            logger.warning("Shared rate limiter unavailable (%s), using local", e)
+
+    def acquire(self):
+        """Block until the caller may send its request."""
+        time.sleep(self.reserve())
+
+    async def aacquire(self):
+        await asyncio.sleep(await sync_to_async(self.reserve)())
+
+    async def apenalize(self, seconds):
+        await sync_to_async(self.penalize)(seconds)
@@ -0,0 +1,110 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+
+def fixture_path(directory, url):
+    """
+    Maps an arxiv.org url to its fixture file, e.g. ``/list/cs.AI/new`` to
+    ``<directory>/list/cs.AI/new.html`` and ``/`` to ``<directory>/index.html``.
+
+    The query string is part of the key, so ``/oai2?verb=ListRecords`` maps to
+    ``<directory>/oai2@verb=ListRecords.html``. Parameters are sorted and
+    quoted, slashes included, to keep one file per distinct request.
+    """
+    parts = urlsplit(url)
+    path = parts.path.strip("/") or "index"
+    if parts.query:
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        path = f"{path}@{quote(query, safe='=&')}"
+    root = os.path.abspath(directory)
+    fixture = os.path.abspath(os.path.join(root, f"{path}.html"))
+    # Refuse urls escaping the recordings directory
+    if os.path.commonpath([fixture, root]) != root:
+        raise ValueError(f"{url} does not map into {directory}")
+    return fixture
+
+
+class Recorder:
+    """Saves the body of every fetched page as a replayable fixture."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def save(self, url, text):
+        path = fixture_path(self.directory, url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        logger.debug("Recorded %s to %s", url, path)
+
+
+class ReplayServer:
+    """
+    Serves recorded fixtures over HTTP on a local port, standing in for
+    arxiv.org. Urls without a fixture answer 404. Fixtures carry an ETag,
+    and a request revalidating it is answered 304 like arxiv.org does.
+
+    Use as a context manager and point ``ARXIV_BASE_URL`` at ``url``.
+
+    :param directory: recordings directory, as written by ``Recorder``
+    :param latency: seconds to wait before answering each request
+    """
+
+    def __init__(self, directory, latency=0):
+        self.directory = directory
+        self.latency = latency
+        self.requests = 0
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                try:
+                    with open(fixture_path(server.directory, self.path), "rb") as file:
+                        body = file.read()
+                except (OSError, ValueError):
+                    self.send_error(404)
+                    return
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        host, port = self._server.server_address
+        self.url = f"http://{host}:{port}"
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+
+from newsletter.models import Paper, PaperChunks
+from newsletter.utils.model_registry import registry
+from newsletter.utils.vector_index import get_vector_index
+
+
+def load_chunks(ids):
+    """:return: dict mapping ``ids`` to their chunk, with its paper"""
+    return (
+        PaperChunks.objects.select_related("paper")
+        .defer("embedding", "embedding_half")
+        .in_bulk(ids)
+    )
+
+
+class PaperSearchResult:
+    def __init__(self, score, paper, chunks):
+        self.score = score
+        self.paper = paper
+        self.chunks = chunks
+
+    def __str__(self):
+        return f"{self.score}: {self.paper.title}"
+
+
+class SemanticSearch:
+    """
+    Searches the papers whose chunks are closest to a query.
+
+    Only the ``candidates`` nearest chunks are read from the vector index,
+    through the HNSW indexes on Postgres, and they are grouped by paper, so
+    the cost of a query does not grow with the number of chunks.
+    """
+
+    def __init__(self, candidates=None, page_size=None, index=None):
+        self.candidates = candidates or settings.SEARCH_CANDIDATES
+        self.page_size = page_size or settings.SEARCH_PAGE_SIZE
+        self.index = index or get_vector_index()
+
+    def paper_hits(self, query):
+        """``PaperHit`` of every matching paper, best papers first."""
+        return self.index.best_per_paper(registry.encode(query), self.candidates)
+
+    def search(self, query, page=1):
+        """
+        :return: ``Page`` of ``PaperSearchResult``, lowest (best) score first,
+            each with the paper's closest chunk
+        """
+        page = Paginator(self.paper_hits(query), self.page_size).get_page(page)
+        chunks = load_chunks([hit.chunk_id for hit in page.object_list])
+        page.object_list = [
+            PaperSearchResult(hit.score, chunk.paper, [chunk])
+            for hit in page.object_list
+            if (chunk := chunks.get(hit.chunk_id))
+        ]
+        return page
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge rankings of ids, best first, into one list of ``(id, score)``.
+    An id scores ``1 / (k + rank)`` in every ranking it appears in, so ids
+    ranked well by several rankings come first, whatever their raw scores.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, 1):
+            scores[id] = scores.get(id, 0) + 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridSearch:
+    """
+    Full-text search of the papers fused with ``SemanticSearch`` by
+    reciprocal rank fusion. Paper numbers, author names and quoted phrases
+    are found by the full-text index, paraphrases by the embeddings.
+    """
+
+    def __init__(self, candidates=None, page_size=None, rrf_k=None):
+        self.semantic = SemanticSearch(candidates, page_size)
+        self.candidates = self.semantic.candidates
+        self.page_size = self.semantic.page_size
+        self.rrf_k = rrf_k or settings.SEARCH_RRF_K
+
+    def search(self, query, page=1):
+        """
+        :return: ``Page`` of ``PaperSearchResult``, highest (best) fused
+            score first, with the paper's closest chunk when it was among
+            the semantic candidates
+        """
+        rankings = [Paper.objects.lexical_ranking(query, self.candidates)]
+        hits = {}
+        # The full-text results alone until the vector index is built
+        if self.semantic.index.is_available():
+            hits = {hit.paper_id: hit for hit in self.semantic.paper_hits(query)}
+            rankings.append(list(hits))
+
+        paginator = Paginator(
+            reciprocal_rank_fusion(rankings, self.rrf_k), self.page_size
+        )
+        page = paginator.get_page(page)
+        ids = [id for id, _ in page.object_list]
+        papers = Paper.objects.in_bulk(ids)
+        chunks = load_chunks([hits[id].chunk_id for id in ids if id in hits])
+        page.object_list = [
+            PaperSearchResult(
+                score,
+                papers[id],
+                [chunks[hits[id].chunk_id]]
+                if id in hits and hits[id].chunk_id in chunks
+                else [],
+            )
+            for id, score in page.object_list
+            if id in papers
+        ]
+        return page
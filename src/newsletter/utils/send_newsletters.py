@@ -55,7 +55,8 @@ class NewsletterEmailSender:
     @staticmethod
     def _get_newsletter(topic: Category):
         subject = f"ArxivDigest - {topic.name}"
-        papers = Paper.objects.filter(categories=topic, is_visible=True)
+        # Papers are linked to leaf categories, archives gather their descendants
+        papers = Paper.objects.visible().under(topic)
 
         context = {
             "topic": topic,
@@ -0,0 +1,75 @@
+import os
+import gzip
+import json
+import bisect
+import itertools
+
+
+class SnapshotWriter:
+    """
+    Appends paper records to a gzip-compressed JSON lines snapshot, one
+    record per line.
+
+    Records are compressed in blocks of ``block_size``, each block being a
+    separate gzip member. The start of every member is written to a
+    sidecar ``.idx`` file as ``<first record> <byte offset> <records>``,
+    which lets ``read_snapshot`` start reading near any record offset
+    without decompressing the blocks before it. Existing data is never
+    rewritten, only appended to.
+    """
+
+    def __init__(self, path, block_size=256):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.block_size = block_size
+        self.count = sum(entry[2] for entry in _read_index(self.index_path))
+
+    def write(self, records):
+        """Append ``records`` to the snapshot; returns the number written."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        written = 0
+        records = iter(records)
+        with open(self.path, "ab") as file, open(self.index_path, "a") as index:
+            while block := list(itertools.islice(records, self.block_size)):
+                lines = "".join(json.dumps(record) + "\n" for record in block)
+                offset = file.tell()
+                file.write(gzip.compress(lines.encode("utf-8")))
+                index.write(f"{self.count} {offset} {len(block)}\n")
+                self.count += len(block)
+                written += len(block)
+        return written
+
+
+def _read_index(index_path):
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, "r") as index:
+        return [tuple(map(int, line.split())) for line in index if line.strip()]
+
+
+def read_snapshot(path, offset=0, limit=None):
+    """
+    Stream the records of a snapshot written by ``SnapshotWriter``.
+
+    :param path: snapshot file path
+    :param offset: number of records to skip
+    :param limit: maximum number of records to yield, all if None
+    """
+    index = _read_index(f"{path}.idx")
+    # Seek to the last block starting at or before ``offset``
+    position = bisect.bisect_right([entry[0] for entry in index], offset) - 1
+    first_record, byte_offset = index[position][:2] if position >= 0 else (0, 0)
+
+    with open(path, "rb") as file:
+        file.seek(byte_offset)
+        with gzip.open(file, "rt", encoding="utf-8") as lines:
+            lines = itertools.islice(
+                lines,
+                offset - first_record,
+                None if limit is None else offset - first_record + limit,
+            )
+            for line in lines:
+                yield json.loads(line)
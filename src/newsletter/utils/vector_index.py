@@ -0,0 +1,463 @@
+import os
+import json
+import uuid
+import fcntl
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+
+from newsletter.models import PaperChunks
+from newsletter.querysets import ann_search
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChunkHit:
+    chunk_id: uuid.UUID
+    paper_id: int
+    distance: float
+
+
+@dataclass
+class PaperHit:
+    paper_id: int
+    # The paper's closest chunk and its distance
+    chunk_id: uuid.UUID
+    distance: float
+    # Mean distance and number of the paper's chunks among the candidates
+    score: float
+    hits: int
+
+
+def index_rows(k):
+    """Rows the first pgvector index scan of a ``nearest(k=k)`` returns."""
+    if settings.EMBEDDING_HALF_PRECISION:
+        return k * settings.EMBEDDING_RERANK_FACTOR
+    return k
+
+
+class VectorIndex:
+    """
+    Nearest neighbour search over the chunk embeddings, in L2 distance like
+    ``PaperChunksQuerySet.nearest``.
+    """
+
+    name = None
+
+    def is_available(self):
+        raise NotImplementedError
+
+    def nearest(self, embedding, k=10):
+        """:return: list of the ``k`` closest ``ChunkHit``, closest first"""
+        raise NotImplementedError
+
+    def best_per_paper(self, embedding, candidates=100):
+        """
+        Group the ``candidates`` chunks closest to ``embedding`` by paper.
+
+        :return: list of ``PaperHit``, lowest (best) score first
+        """
+        papers = {}
+        for hit in self.nearest(embedding, candidates):
+            papers.setdefault(hit.paper_id, []).append(hit)
+        return sorted(
+            (
+                PaperHit(
+                    paper_id=paper_id,
+                    chunk_id=hits[0].chunk_id,
+                    distance=hits[0].distance,
+                    score=sum(hit.distance for hit in hits) / len(hits),
+                    hits=len(hits),
+                )
+                for paper_id, hits in papers.items()
+            ),
+            key=lambda hit: (hit.score, hit.paper_id),
+        )
+
+    def nearest_papers(self, paper_ids, k=5, candidates=50):
+        """
+        The ``k`` papers closest to each of ``paper_ids``, in one batch. A
+        paper is searched for by the mean of its chunk embeddings, and the
+        other papers are ranked by their closest chunk among the
+        ``candidates`` nearest ones.
+
+        :return: dict mapping the ``paper_ids`` that have chunks to the ids
+            of their nearest papers, closest first
+        """
+        raise NotImplementedError
+
+    def replace(self, paper_ids, chunks):
+        """Swap the indexed chunks of ``paper_ids`` for ``chunks``."""
+
+
+class PgvectorIndex(VectorIndex):
+    """The ``PaperChunks`` table itself, searched through its HNSW indexes."""
+
+    name = "pgvector"
+
+    def is_available(self):
+        return connections[PaperChunks.objects.db].vendor == "postgresql"
+
+    def nearest(self, embedding, k=10):
+        chunks = PaperChunks.objects.nearest(embedding, k=k).values_list(
+            "pk", "paper_id", "distance"
+        )
+        with ann_search(chunks.db, index_rows(k)):
+            return [ChunkHit(*chunk) for chunk in chunks]
+
+    def best_per_paper(self, embedding, candidates=100):
+        # Grouped in SQL, only one row per paper is fetched
+        chunks = PaperChunks.objects.best_per_paper(embedding, candidates).values_list(
+            "paper_id", "pk", "distance", "score", "hits"
+        )
+        with ann_search(chunks.db, index_rows(candidates)):
+            return [PaperHit(*chunk) for chunk in chunks]
+
+    def nearest_papers(self, paper_ids, k=5, candidates=50):
+        # One HNSW index scan per paper, all in a single statement
+        table = PaperChunks._meta.db_table
+        sql = f"""
+            WITH queries AS (
+                SELECT paper_id, avg(embedding) AS embedding
+                FROM {table}
+                WHERE paper_id = ANY(%s)
+                GROUP BY paper_id
+            )
+            SELECT q.paper_id, n.paper_id, min(n.distance) AS distance
+            FROM queries q
+            CROSS JOIN LATERAL (
+                SELECT c.paper_id, c.embedding <-> q.embedding AS distance
+                FROM {table} c
+                ORDER BY c.embedding <-> q.embedding
+                LIMIT %s
+            ) n
+            WHERE n.paper_id <> q.paper_id
+            GROUP BY q.paper_id, n.paper_id
+            ORDER BY q.paper_id, distance
+        """
+        using = PaperChunks.objects.db
+        neighbours = {}
+        with ann_search(using, candidates), connections[using].cursor() as cursor:
+            cursor.execute(sql, [list(paper_ids), candidates])
+            for paper_id, neighbour_id, _ in cursor.fetchall():
+                papers = neighbours.setdefault(paper_id, [])
+                if len(papers) < k:
+                    papers.append(neighbour_id)
+        return neighbours
+
+    def replace(self, paper_ids, chunks):
+        # The table is the index
+        pass
+
+
+class NumpyVectorIndex(VectorIndex):
+    """
+    Chunk embeddings in a directory of flat files, memory-mapped and
+    searched by brute force with NumPy. It needs no database extension, so
+    search runs on SQLite in development and CI.
+
+    ``vectors.f32`` holds the float32 embeddings row after row and
+    ``rows.bin`` the chunk id, paper id and squared norm of every row.
+    ``meta.json`` records the number of committed rows: new rows are
+    appended to both files before it is updated. The rows of a replaced
+    paper are tombstoned in place (paper id -1) until the next ``compact``.
+    """
+
+    name = "numpy"
+
+    META_FILE = "meta.json"
+    VECTORS_FILE = "vectors.f32"
+    ROWS_FILE = "rows.bin"
+
+    ROW_DTYPE = np.dtype([("chunk", "V16"), ("paper", "<i8"), ("norm2", "<f4")])
+    # Rows multiplied at once, bounding the memory used by a search
+    BLOCK_SIZE = 65536
+    # Papers searched for at once by nearest_papers
+    QUERY_BATCH_SIZE = 256
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.SEARCH_NUMPY_INDEX_DIR
+        self._lock = threading.Lock()
+        self._loaded = None
+        self.vectors = self.rows = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def is_available(self):
+        return os.path.exists(self._path(self.META_FILE))
+
+    def read_meta(self):
+        if not self.is_available():
+            return None
+        with open(self._path(self.META_FILE), "r") as file:
+            return json.load(file)
+
+    def _write_meta(self, meta):
+        path = self._path(self.META_FILE)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(meta, file)
+        os.replace(f"{path}.tmp", path)
+
+    def _load(self):
+        """Map the committed rows, again whenever ``meta.json`` changed."""
+        stat = os.stat(self._path(self.META_FILE))
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version == self._loaded:
+            return
+        meta = self.read_meta()
+        count, dimensions = meta["count"], meta["dimensions"]
+        if count:
+            self.vectors = np.memmap(
+                self._path(self.VECTORS_FILE),
+                dtype=np.float32,
+                mode="r",
+                shape=(count, dimensions),
+            )
+            self.rows = np.memmap(
+                self._path(self.ROWS_FILE), dtype=self.ROW_DTYPE, mode="r", shape=(count,)
+            )
+        else:
+            self.vectors = np.empty((0, dimensions), dtype=np.float32)
+            self.rows = np.empty(0, dtype=self.ROW_DTYPE)
+        self._loaded = version
+
+    @contextmanager
+    def _writing(self):
+        """Hold the index's write lock, across processes."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Next to the directory, which rebuilds swap
+        with open(f"{self.directory}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def nearest(self, embedding, k=10):
+        if not self.is_available():
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._load()
+            vectors, rows = self.vectors, self.rows
+
+        # |v - q|² = |v|² - 2 v·q + |q|², the best k of every block are kept
+        distances, indices = [], []
+        for start in range(0, len(rows), self.BLOCK_SIZE):
+            block = rows[start : start + self.BLOCK_SIZE]
+            squared = block["norm2"] - 2 * (vectors[start : start + len(block)] @ query)
+            squared[block["paper"] < 0] = np.inf
+            best = np.arange(len(block))
+            if len(block) > k:
+                best = np.argpartition(squared, k)[:k]
+            distances.append(squared[best])
+            indices.append(best + start)
+        if not distances:
+            return []
+
+        distances, indices = np.concatenate(distances), np.concatenate(indices)
+        indices = indices[np.isfinite(distances)]
+        if len(indices) > k:
+            indices = indices[np.argpartition(distances[np.isfinite(distances)], k)[:k]]
+        indices.sort()
+        # The expansion loses precision on close vectors, the k are exact
+        distances = np.linalg.norm(vectors[indices] - query, axis=1)
+        order = np.argsort(distances, kind="stable")
+        return [
+            ChunkHit(
+                chunk_id=uuid.UUID(bytes=rows[i]["chunk"].tobytes()),
+                paper_id=int(rows[i]["paper"]),
+                distance=float(distance),
+            )
+            for i, distance in zip(indices[order], distances[order])
+        ]
+
+    def nearest_papers(self, paper_ids, k=5, candidates=50):
+        if not self.is_available():
+            return {}
+        with self._lock:
+            self._load()
+            vectors, rows = self.vectors, self.rows
+
+        # Mean chunk embedding of every paper searched for
+        selected = np.flatnonzero(np.isin(rows["paper"], list(paper_ids)))
+        if not len(selected):
+            return {}
+        papers, inverse = np.unique(rows["paper"][selected], return_inverse=True)
+        queries = np.zeros((len(papers), vectors.shape[1]), dtype=np.float32)
+        np.add.at(queries, inverse, vectors[selected])
+        queries /= np.bincount(inverse, minlength=len(papers))[:, np.newaxis]
+
+        neighbours = {}
+        for first in range(0, len(papers), self.QUERY_BATCH_SIZE):
+            batch = queries[first : first + self.QUERY_BATCH_SIZE]
+            batch_papers = papers[first : first + self.QUERY_BATCH_SIZE]
+            # One matrix multiply per block of rows, keeping the best
+            # candidates of every paper
+            distances, indices = [], []
+            for start in range(0, len(rows), self.BLOCK_SIZE):
+                block = rows[start : start + self.BLOCK_SIZE]
+                squared = block["norm2"] - 2 * (
+                    batch @ vectors[start : start + len(block)].T
+                )
+                squared[:, block["paper"] < 0] = np.inf
+                squared[block["paper"] == batch_papers[:, np.newaxis]] = np.inf
+                best = min(candidates, len(block))
+                part = np.argpartition(squared, best - 1, axis=1)[:, :best]
+                distances.append(np.take_along_axis(squared, part, axis=1))
+                indices.append(part + start)
+            distances = np.concatenate(distances, axis=1)
+            indices = np.concatenate(indices, axis=1)
+
+            for paper_id, row_distances, row_indices in zip(
+                batch_papers, distances, indices
+            ):
+                order = np.argsort(row_distances, kind="stable")[:candidates]
+                closest = []
+                for i in row_indices[order[np.isfinite(row_distances[order])]]:
+                    neighbour = int(rows[i]["paper"])
+                    if neighbour not in closest:
+                        closest.append(neighbour)
+                        if len(closest) == k:
+                            break
+                neighbours[int(paper_id)] = closest
+        return neighbours
+
+    def _append(self, meta, chunk_ids, paper_ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        if meta["dimensions"] != vectors.shape[1]:
+            raise ValueError(
+                f"Index of {meta['dimensions']} dimensions, got {vectors.shape[1]}"
+            )
+        rows = np.empty(len(vectors), dtype=self.ROW_DTYPE)
+        rows["chunk"] = [chunk_id.bytes for chunk_id in chunk_ids]
+        rows["paper"] = paper_ids
+        rows["norm2"] = np.einsum("ij,ij->i", vectors, vectors)
+
+        for name, data, size in (
+            (self.VECTORS_FILE, vectors, vectors.shape[1] * 4),
+            (self.ROWS_FILE, rows, self.ROW_DTYPE.itemsize),
+        ):
+            with open(self._path(name), "ab") as file:
+                # Drops the rows of an append that died before committing
+                file.truncate(meta["count"] * size)
+                file.write(data.tobytes())
+        meta["count"] += len(rows)
+
+    def replace(self, paper_ids, chunks):
+        paper_ids = list(paper_ids)
+        with self._writing():
+            meta = self.read_meta()
+            if meta is None:
+                if not chunks:
+                    return
+                meta = {"dimensions": len(chunks[0].embedding), "count": 0, "deleted": 0}
+
+            if meta["count"] and paper_ids:
+                rows = np.memmap(
+                    self._path(self.ROWS_FILE),
+                    dtype=self.ROW_DTYPE,
+                    mode="r+",
+                    shape=(meta["count"],),
+                )
+                stale = np.isin(rows["paper"], paper_ids)
+                rows["paper"][stale] = -1
+                rows.flush()
+                meta["deleted"] += int(stale.sum())
+                del rows
+
+            if chunks:
+                self._append(
+                    meta,
+                    [chunk.pk for chunk in chunks],
+                    [chunk.paper_id for chunk in chunks],
+                    [chunk.embedding for chunk in chunks],
+                )
+            self._write_meta(meta)
+
+    def _rebuild(self, batches, dimensions):
+        directory = f"{self.directory}.new"
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        index = NumpyVectorIndex(directory)
+        meta = {"dimensions": dimensions, "count": 0, "deleted": 0}
+        for chunk_ids, paper_ids, vectors in batches:
+            index._append(meta, chunk_ids, paper_ids, vectors)
+        index._write_meta(meta)
+
+        # Searches already holding the old maps keep reading the old files
+        old = f"{self.directory}.old"
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(self.directory, old)
+        os.replace(directory, self.directory)
+        shutil.rmtree(old, ignore_errors=True)
+        logger.info("Built vector index %s of %s rows", self.directory, meta["count"])
+        return meta["count"]
+
+    def rebuild(self, batches, dimensions):
+        """
+        Build the index again from ``batches`` of (chunk ids, paper ids,
+        vectors), then swap it in place of the current one. Writers wait
+        until it is done.
+
+        :return: the number of rows
+        """
+        with self._writing():
+            return self._rebuild(batches, dimensions)
+
+    def compact(self):
+        """
+        Rewrite the index without its tombstoned rows.
+
+        :return: the number of rows left
+        """
+        if not self.is_available():
+            return 0
+
+        def batches(vectors, rows):
+            for start in range(0, len(rows), self.BLOCK_SIZE):
+                block = rows[start : start + self.BLOCK_SIZE]
+                live = block["paper"] >= 0
+                yield (
+                    [uuid.UUID(bytes=chunk.tobytes()) for chunk in block["chunk"][live]],
+                    block["paper"][live],
+                    vectors[start : start + len(block)][live],
+                )
+
+        with self._writing():
+            meta = self.read_meta()
+            with self._lock:
+                self._load()
+                vectors, rows = self.vectors, self.rows
+            return self._rebuild(batches(vectors, rows), meta["dimensions"])
+
+
+VECTOR_INDEXES = {index.name: index for index in (PgvectorIndex, NumpyVectorIndex)}
+
+_indexes = {}
+
+
+def get_vector_index(name=None):
+    """
+    Return the vector index named by ``SEARCH_VECTOR_INDEX``, by default
+    pgvector on Postgres and NumPy on any other database.
+    """
+    name = name or settings.SEARCH_VECTOR_INDEX
+    if not name:
+        vendor = connections[PaperChunks.objects.db].vendor
+        name = "pgvector" if vendor == "postgresql" else "numpy"
+    # One instance per process, so the NumPy index stays mapped
+    if name not in _indexes:
+        _indexes[name] = VECTOR_INDEXES[name]()
+    return _indexes[name]
@@ -38,7 +38,7 @@ class CategoryDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        papers = Paper.objects.filter(topics=self.object).visible()
+        papers = Paper.objects.visible().under(self.object)
         paginator = Paginator(papers, 25)
 
         page_number = self.request.GET.get("page")
@@ -54,6 +54,12 @@ class PaperDetailView(DetailView):
     slug_field = "paper_number"
     context_object_name = "paper"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Precomputed by the daily workflow, see the similar_papers command
+        context["similar_papers"] = self.object.similar_papers.visible()
+        return context
+
 
 class NewsletterView(FormView):
     form_class = SubscriptionForm